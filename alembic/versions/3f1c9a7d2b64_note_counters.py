@@ -0,0 +1,103 @@
+"""note counters
+
+Revision ID: 3f1c9a7d2b64
+Revises: bd7afbfe80e6
+Create Date: 2024-02-03 11:20:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2b64'
+down_revision: Union[str, None] = 'bd7afbfe80e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('note_counters',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('owned_notes', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('shared_notes', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    # Increments upsert the counter row; decrements only touch an existing row
+    # so that cascading deletes of a user never try to re-create it.
+    op.execute("""
+    CREATE OR REPLACE FUNCTION bump_note_counter(
+        p_user_id integer, p_owned integer, p_shared integer
+    ) RETURNS void AS $$
+    BEGIN
+        IF p_owned < 0 OR p_shared < 0 THEN
+            UPDATE note_counters
+            SET owned_notes = owned_notes + p_owned,
+                shared_notes = shared_notes + p_shared
+            WHERE user_id = p_user_id;
+        ELSE
+            INSERT INTO note_counters (user_id, owned_notes, shared_notes)
+            VALUES (p_user_id, p_owned, p_shared)
+            ON CONFLICT (user_id) DO UPDATE
+            SET owned_notes = note_counters.owned_notes + EXCLUDED.owned_notes,
+                shared_notes = note_counters.shared_notes + EXCLUDED.shared_notes;
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION notes_count_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            PERFORM bump_note_counter(OLD.owner_id, -1, 0);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM bump_note_counter(NEW.owner_id, 1, 0);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION shared_notes_count_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM bump_note_counter(OLD.user_id, 0, -1);
+        ELSE
+            PERFORM bump_note_counter(NEW.user_id, 0, 1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE TRIGGER notes_count
+    AFTER INSERT OR DELETE OR UPDATE OF owner_id ON notes
+    FOR EACH ROW EXECUTE FUNCTION notes_count_trigger();
+    """)
+    op.execute("""
+    CREATE TRIGGER shared_notes_count
+    AFTER INSERT OR DELETE ON shared_notes
+    FOR EACH ROW EXECUTE FUNCTION shared_notes_count_trigger();
+    """)
+
+    op.execute("""
+    INSERT INTO note_counters (user_id, owned_notes, shared_notes)
+    SELECT users.id,
+           (SELECT count(*) FROM notes WHERE notes.owner_id = users.id),
+           (SELECT count(*) FROM shared_notes WHERE shared_notes.user_id = users.id)
+    FROM users
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS shared_notes_count ON shared_notes")
+    op.execute("DROP TRIGGER IF EXISTS notes_count ON notes")
+    op.execute("DROP FUNCTION IF EXISTS shared_notes_count_trigger()")
+    op.execute("DROP FUNCTION IF EXISTS notes_count_trigger()")
+    op.execute("DROP FUNCTION IF EXISTS bump_note_counter(integer, integer, integer)")
+    op.drop_table('note_counters')
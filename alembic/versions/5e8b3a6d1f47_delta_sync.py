@@ -0,0 +1,165 @@
+"""delta sync
+
+Revision ID: 5e8b3a6d1f47
+Revises: c7d41e2b8f56
+Create Date: 2024-03-02 10:48:27.551630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8b3a6d1f47'
+down_revision: Union[str, None] = 'c7d41e2b8f56'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+next_version = sa.text("nextval('sync_version_seq')")
+current_xid = sa.text("pg_current_xact_id()::text::bigint")
+
+
+def _backfill(statement: str, key: str, table: str) -> None:
+    """Runs `statement` for each :low < key <= :high range, one commit each."""
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        highest = bind.execute(
+            sa.text(f"SELECT coalesce(max({key}), 0) FROM {table}")
+        ).scalar()
+        for low in range(0, highest, BATCH_SIZE):
+            bind.execute(sa.text(statement), {"low": low, "high": low + BATCH_SIZE})
+
+
+def upgrade() -> None:
+    op.execute("CREATE SEQUENCE sync_version_seq")
+
+    # 1. Nullable columns without a default do not rewrite the partitions,
+    #    the defaults only apply to rows written from now on
+    op.add_column('notes', sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=True))
+    op.add_column('notes', sa.Column('sync_version', sa.BigInteger(), nullable=True))
+    op.add_column('notes', sa.Column('sync_xid', sa.BigInteger(), nullable=True))
+    op.add_column('shared_notes', sa.Column('sync_version', sa.BigInteger(), nullable=True))
+    op.add_column('shared_notes', sa.Column('sync_xid', sa.BigInteger(), nullable=True))
+    op.alter_column('notes', 'updated_at', server_default=sa.text('now()'))
+    op.alter_column('notes', 'sync_version', server_default=next_version)
+    op.alter_column('notes', 'sync_xid', server_default=current_xid)
+    op.alter_column('shared_notes', 'sync_version', server_default=next_version)
+    op.alter_column('shared_notes', 'sync_xid', server_default=current_xid)
+
+    # 2. Existing rows are numbered in batches, before the touch triggers
+    #    exist so updated_at keeps the creation time
+    _backfill("""
+    UPDATE notes
+    SET updated_at = created_at,
+        sync_version = nextval('sync_version_seq'),
+        sync_xid = pg_current_xact_id()::text::bigint
+    WHERE id > :low AND id <= :high AND sync_version IS NULL
+    """, 'id', 'notes')
+    _backfill("""
+    UPDATE shared_notes
+    SET sync_version = nextval('sync_version_seq'),
+        sync_xid = pg_current_xact_id()::text::bigint
+    WHERE user_id > :low AND user_id <= :high AND sync_version IS NULL
+    """, 'user_id', 'shared_notes')
+
+    # 3. SET NOT NULL only scans the partitions
+    op.alter_column('notes', 'updated_at', nullable=False)
+    op.alter_column('notes', 'sync_version', nullable=False)
+    op.alter_column('notes', 'sync_xid', nullable=False)
+    op.alter_column('shared_notes', 'sync_version', nullable=False)
+    op.alter_column('shared_notes', 'sync_xid', nullable=False)
+    op.create_index('ix_notes_owner_id_sync_xid', 'notes', ['owner_id', 'sync_xid', 'sync_version'], unique=False)
+    op.create_index('ix_shared_notes_user_id_sync_xid', 'shared_notes', ['user_id', 'sync_xid', 'sync_version'], unique=False)
+
+    op.create_table('note_tombstones',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('sync_version', sa.BigInteger(), server_default=next_version, nullable=False),
+    sa.Column('sync_xid', sa.BigInteger(), server_default=current_xid, nullable=False),
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'sync_version')
+    )
+    op.create_index('ix_note_tombstones_user_id_sync_xid', 'note_tombstones', ['user_id', 'sync_xid', 'sync_version'], unique=False)
+
+    op.execute("""
+    CREATE OR REPLACE FUNCTION notes_touch_trigger() RETURNS trigger AS $$
+    BEGIN
+        NEW.updated_at := now();
+        NEW.sync_version := nextval('sync_version_seq');
+        NEW.sync_xid := pg_current_xact_id()::text::bigint;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION shared_notes_touch_trigger() RETURNS trigger AS $$
+    BEGIN
+        NEW.sync_version := nextval('sync_version_seq');
+        NEW.sync_xid := pg_current_xact_id()::text::bigint;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    # Users that are being deleted themselves do not need (and could not
+    # reference) a tombstone.
+    op.execute("""
+    CREATE OR REPLACE FUNCTION note_tombstone_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_TABLE_NAME = 'notes' THEN
+            INSERT INTO note_tombstones (user_id, note_id)
+            SELECT OLD.owner_id, OLD.id
+            WHERE EXISTS (SELECT 1 FROM users WHERE id = OLD.owner_id);
+        ELSE
+            INSERT INTO note_tombstones (user_id, note_id)
+            SELECT OLD.user_id, OLD.note_id
+            WHERE EXISTS (SELECT 1 FROM users WHERE id = OLD.user_id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE TRIGGER notes_touch
+    BEFORE UPDATE ON notes
+    FOR EACH ROW EXECUTE FUNCTION notes_touch_trigger();
+    """)
+    op.execute("""
+    CREATE TRIGGER shared_notes_touch
+    BEFORE UPDATE ON shared_notes
+    FOR EACH ROW EXECUTE FUNCTION shared_notes_touch_trigger();
+    """)
+    op.execute("""
+    CREATE TRIGGER notes_tombstone
+    AFTER DELETE ON notes
+    FOR EACH ROW EXECUTE FUNCTION note_tombstone_trigger();
+    """)
+    op.execute("""
+    CREATE TRIGGER shared_notes_tombstone
+    AFTER DELETE ON shared_notes
+    FOR EACH ROW EXECUTE FUNCTION note_tombstone_trigger();
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS shared_notes_tombstone ON shared_notes")
+    op.execute("DROP TRIGGER IF EXISTS notes_tombstone ON notes")
+    op.execute("DROP TRIGGER IF EXISTS shared_notes_touch ON shared_notes")
+    op.execute("DROP TRIGGER IF EXISTS notes_touch ON notes")
+    op.execute("DROP FUNCTION IF EXISTS note_tombstone_trigger()")
+    op.execute("DROP FUNCTION IF EXISTS shared_notes_touch_trigger()")
+    op.execute("DROP FUNCTION IF EXISTS notes_touch_trigger()")
+    op.drop_index('ix_note_tombstones_user_id_sync_xid', table_name='note_tombstones')
+    op.drop_table('note_tombstones')
+    op.drop_index('ix_shared_notes_user_id_sync_xid', table_name='shared_notes')
+    op.drop_index('ix_notes_owner_id_sync_xid', table_name='notes')
+    op.drop_column('shared_notes', 'sync_xid')
+    op.drop_column('shared_notes', 'sync_version')
+    op.drop_column('notes', 'sync_xid')
+    op.drop_column('notes', 'sync_version')
+    op.drop_column('notes', 'updated_at')
+    op.execute("DROP SEQUENCE sync_version_seq")
@@ -0,0 +1,28 @@
+"""notes detail storage external
+
+Revision ID: a2f7c9e4b318
+Revises: 5e8b3a6d1f47
+Create Date: 2024-03-09 14:31:06.208745
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2f7c9e4b318'
+down_revision: Union[str, None] = '5e8b3a6d1f47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Out-of-line but uncompressed values let substr() fetch only the TOAST
+    # chunks of the requested range. Applies to rows written from now on.
+    op.execute("ALTER TABLE notes ALTER COLUMN detail SET STORAGE EXTERNAL")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE notes ALTER COLUMN detail SET STORAGE EXTENDED")
@@ -0,0 +1,84 @@
+"""notes detail length
+
+Revision ID: b6e2d4a8c971
+Revises: f1a6d9c3e724
+Create Date: 2024-03-30 11:02:44.817392
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6e2d4a8c971'
+down_revision: Union[str, None] = 'f1a6d9c3e724'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+
+def _backfill(statement: str, key: str, table: str) -> None:
+    """Runs `statement` for each :low < key <= :high range, one commit each."""
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        highest = bind.execute(
+            sa.text(f"SELECT coalesce(max({key}), 0) FROM {table}")
+        ).scalar()
+        for low in range(0, highest, BATCH_SIZE):
+            bind.execute(sa.text(statement), {"low": low, "high": low + BATCH_SIZE})
+
+
+def upgrade() -> None:
+    # 1. Nullable without a default, so adding it does not rewrite the partitions
+    op.add_column('notes', sa.Column('detail_length', sa.Integer(), nullable=True))
+
+    # 2. The trigger exists before the backfill so notes written meanwhile are
+    #    counted too. Reads select the column instead of char_length(detail),
+    #    which would detoast every body.
+    op.execute("""
+    CREATE OR REPLACE FUNCTION notes_detail_length_trigger() RETURNS trigger AS $$
+    BEGIN
+        NEW.detail_length := char_length(NEW.detail);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE TRIGGER notes_detail_length
+    BEFORE INSERT OR UPDATE OF detail ON notes
+    FOR EACH ROW EXECUTE FUNCTION notes_detail_length_trigger();
+    """)
+
+    # 3. Only edits touch a note, so measuring the existing rows below (and
+    #    anything else maintained on the row) does not resend them to delta sync
+    op.execute("DROP TRIGGER notes_touch ON notes")
+    op.execute("""
+    CREATE TRIGGER notes_touch
+    BEFORE UPDATE OF title, detail, owner_id ON notes
+    FOR EACH ROW EXECUTE FUNCTION notes_touch_trigger();
+    """)
+
+    # 4. Existing rows are measured in batches
+    _backfill("""
+    UPDATE notes
+    SET detail_length = char_length(detail)
+    WHERE id > :low AND id <= :high AND detail_length IS NULL
+    """, 'id', 'notes')
+
+    # 5. SET NOT NULL only scans the partitions
+    op.alter_column('notes', 'detail_length', nullable=False)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER notes_touch ON notes")
+    op.execute("""
+    CREATE TRIGGER notes_touch
+    BEFORE UPDATE ON notes
+    FOR EACH ROW EXECUTE FUNCTION notes_touch_trigger();
+    """)
+    op.execute("DROP TRIGGER IF EXISTS notes_detail_length ON notes")
+    op.execute("DROP FUNCTION IF EXISTS notes_detail_length_trigger()")
+    op.drop_column('notes', 'detail_length')
@@ -0,0 +1,258 @@
+"""partition notes by owner
+
+Revision ID: c7d41e2b8f56
+Revises: 8c2e5f0a9d13
+Create Date: 2024-02-17 09:42:27.511863
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7d41e2b8f56'
+down_revision: Union[str, None] = '8c2e5f0a9d13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS = 16
+BATCH_SIZE = 10000
+
+permissions = postgresql.ENUM('edit', 'read_only', name='permissions', create_type=False)
+
+
+def _create_partitions(table: str, name: str) -> None:
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f"CREATE TABLE {name}_p{remainder} PARTITION OF {table} "
+            f"FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})"
+        )
+
+
+def _rename_partitions(old: str, new: str) -> None:
+    for remainder in range(PARTITIONS):
+        op.execute(f"ALTER TABLE {old}_p{remainder} RENAME TO {new}_p{remainder}")
+
+
+def _backfill(statement: str, key: str, table: str) -> None:
+    """Runs `statement` for each :low < key <= :high range, one commit each."""
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        highest = bind.execute(
+            sa.text(f"SELECT coalesce(max({key}), 0) FROM {table}")
+        ).scalar()
+        for low in range(0, highest, BATCH_SIZE):
+            bind.execute(sa.text(statement), {"low": low, "high": low + BATCH_SIZE})
+
+
+def upgrade() -> None:
+    # 1. Partitioned copies of both tables, shared_notes carries the owner of
+    #    the note so it can reference the (id, owner_id) key of notes
+    op.create_table('notes_partitioned',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('notes_id_seq'::regclass)"), nullable=False),
+    sa.Column('title', sa.String(), nullable=False),
+    sa.Column('detail', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id', 'owner_id', name='notes_partitioned_pkey'),
+    postgresql_partition_by='HASH (owner_id)'
+    )
+    _create_partitions('notes_partitioned', 'notes_partitioned')
+    op.create_index('ix_notes_partitioned_created_at', 'notes_partitioned', ['created_at'], unique=False)
+    op.create_index('ix_notes_partitioned_title', 'notes_partitioned', ['title'], unique=False)
+    op.create_index('ix_notes_partitioned_owner_id_created_at', 'notes_partitioned', ['owner_id', 'created_at', 'id'], unique=False)
+
+    op.create_table('shared_notes_partitioned',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.Column('note_owner_id', sa.Integer(), nullable=False),
+    sa.Column('permission', permissions, nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['note_id', 'note_owner_id'], ['notes_partitioned.id', 'notes_partitioned.owner_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'note_id', name='shared_notes_partitioned_pkey'),
+    postgresql_partition_by='HASH (user_id)'
+    )
+    _create_partitions('shared_notes_partitioned', 'shared_notes_partitioned')
+    op.create_index('ix_shared_notes_partitioned_created_at', 'shared_notes_partitioned', ['created_at'], unique=False)
+    op.create_index('ix_shared_notes_partitioned_permission', 'shared_notes_partitioned', ['permission'], unique=False)
+    op.create_index('ix_shared_notes_partitioned_note_id', 'shared_notes_partitioned', ['note_id'], unique=False)
+
+    # 2. Mirror every write to the old tables while the copy runs
+    op.execute("""
+    CREATE FUNCTION notes_mirror_trigger() RETURNS trigger AS $$
+    BEGIN
+        -- Updated in place, deleting would cascade to the mirrored shares.
+        -- Notes never change owner, and a row not copied yet is picked up
+        -- by the backfill.
+        IF TG_OP = 'UPDATE' THEN
+            UPDATE notes_partitioned
+            SET title = NEW.title, detail = NEW.detail, created_at = NEW.created_at
+            WHERE id = OLD.id AND owner_id = OLD.owner_id;
+        ELSIF TG_OP = 'DELETE' THEN
+            DELETE FROM notes_partitioned
+            WHERE id = OLD.id AND owner_id = OLD.owner_id;
+        ELSE
+            INSERT INTO notes_partitioned (id, title, detail, created_at, owner_id)
+            VALUES (NEW.id, NEW.title, NEW.detail, NEW.created_at, NEW.owner_id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE FUNCTION shared_notes_mirror_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            DELETE FROM shared_notes_partitioned
+            WHERE user_id = OLD.user_id AND note_id = OLD.note_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO shared_notes_partitioned
+                (user_id, note_id, note_owner_id, permission, created_at)
+            SELECT NEW.user_id, NEW.note_id, notes.owner_id, NEW.permission, NEW.created_at
+            FROM notes WHERE notes.id = NEW.note_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE TRIGGER notes_mirror
+    AFTER INSERT OR UPDATE OR DELETE ON notes
+    FOR EACH ROW EXECUTE FUNCTION notes_mirror_trigger();
+    """)
+
+    # 3. Copy in small committed batches. FOR SHARE makes a batch wait for
+    #    concurrent writers, so their mirrored change always lands after it
+    #    and a row deleted meanwhile is skipped rather than resurrected.
+    #    Notes go first: shared rows reference them.
+    _backfill("""
+    WITH batch AS (
+        SELECT id, title, detail, created_at, owner_id FROM notes
+        WHERE id > :low AND id <= :high
+        FOR SHARE
+    )
+    INSERT INTO notes_partitioned (id, title, detail, created_at, owner_id)
+    SELECT * FROM batch
+    ON CONFLICT DO NOTHING
+    """, 'id', 'notes')
+
+    op.execute("""
+    CREATE TRIGGER shared_notes_mirror
+    AFTER INSERT OR UPDATE OR DELETE ON shared_notes
+    FOR EACH ROW EXECUTE FUNCTION shared_notes_mirror_trigger();
+    """)
+    _backfill("""
+    WITH batch AS (
+        SELECT shared_notes.user_id, shared_notes.note_id, notes.owner_id,
+               shared_notes.permission, shared_notes.created_at
+        FROM shared_notes
+        JOIN notes ON notes.id = shared_notes.note_id
+        WHERE shared_notes.user_id > :low AND shared_notes.user_id <= :high
+        FOR SHARE OF shared_notes
+    )
+    INSERT INTO shared_notes_partitioned
+        (user_id, note_id, note_owner_id, permission, created_at)
+    SELECT * FROM batch
+    ON CONFLICT DO NOTHING
+    """, 'user_id', 'shared_notes')
+
+    # 4. Swap under a short exclusive lock
+    op.execute("LOCK TABLE notes, shared_notes IN ACCESS EXCLUSIVE MODE")
+    op.execute("DROP TRIGGER shared_notes_mirror ON shared_notes")
+    op.execute("DROP TRIGGER notes_mirror ON notes")
+    op.execute("DROP FUNCTION shared_notes_mirror_trigger()")
+    op.execute("DROP FUNCTION notes_mirror_trigger()")
+    op.execute("ALTER SEQUENCE notes_id_seq OWNED BY NONE")
+    op.drop_table('shared_notes')
+    op.drop_table('notes')
+
+    op.rename_table('notes_partitioned', 'notes')
+    _rename_partitions('notes_partitioned', 'notes')
+    op.execute("ALTER TABLE notes RENAME CONSTRAINT notes_partitioned_pkey TO notes_pkey")
+    op.execute("ALTER INDEX ix_notes_partitioned_created_at RENAME TO ix_notes_created_at")
+    op.execute("ALTER INDEX ix_notes_partitioned_title RENAME TO ix_notes_title")
+    op.execute("ALTER INDEX ix_notes_partitioned_owner_id_created_at RENAME TO ix_notes_owner_id_created_at")
+    op.execute("ALTER SEQUENCE notes_id_seq OWNED BY notes.id")
+
+    op.rename_table('shared_notes_partitioned', 'shared_notes')
+    _rename_partitions('shared_notes_partitioned', 'shared_notes')
+    op.execute("ALTER TABLE shared_notes RENAME CONSTRAINT shared_notes_partitioned_pkey TO shared_notes_pkey")
+    op.execute("ALTER INDEX ix_shared_notes_partitioned_created_at RENAME TO ix_shared_notes_created_at")
+    op.execute("ALTER INDEX ix_shared_notes_partitioned_permission RENAME TO ix_shared_notes_permission")
+    op.execute("ALTER INDEX ix_shared_notes_partitioned_note_id RENAME TO ix_shared_notes_note_id")
+
+    # The counter triggers went away with the old tables
+    op.execute("""
+    CREATE TRIGGER notes_count
+    AFTER INSERT OR DELETE OR UPDATE OF owner_id ON notes
+    FOR EACH ROW EXECUTE FUNCTION notes_count_trigger();
+    """)
+    op.execute("""
+    CREATE TRIGGER shared_notes_count
+    AFTER INSERT OR DELETE ON shared_notes
+    FOR EACH ROW EXECUTE FUNCTION shared_notes_count_trigger();
+    """)
+
+
+def downgrade() -> None:
+    # Offline: copies everything back into plain tables under lock
+    op.execute("LOCK TABLE notes, shared_notes IN ACCESS EXCLUSIVE MODE")
+    op.create_table('notes_unpartitioned',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('notes_id_seq'::regclass)"), nullable=False),
+    sa.Column('title', sa.String(), nullable=False),
+    sa.Column('detail', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id', name='notes_unpartitioned_pkey')
+    )
+    op.create_table('shared_notes_unpartitioned',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.Column('permission', permissions, nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['note_id'], ['notes_unpartitioned.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'note_id', name='shared_notes_unpartitioned_pkey')
+    )
+    op.execute("""
+    INSERT INTO notes_unpartitioned (id, title, detail, created_at, owner_id)
+    SELECT id, title, detail, created_at, owner_id FROM notes
+    """)
+    op.execute("""
+    INSERT INTO shared_notes_unpartitioned (user_id, note_id, permission, created_at)
+    SELECT user_id, note_id, permission, created_at FROM shared_notes
+    """)
+
+    op.execute("ALTER SEQUENCE notes_id_seq OWNED BY NONE")
+    op.drop_table('shared_notes')
+    op.drop_table('notes')
+
+    op.rename_table('notes_unpartitioned', 'notes')
+    op.execute("ALTER TABLE notes RENAME CONSTRAINT notes_unpartitioned_pkey TO notes_pkey")
+    op.execute("ALTER SEQUENCE notes_id_seq OWNED BY notes.id")
+    op.create_index(op.f('ix_notes_created_at'), 'notes', ['created_at'], unique=False)
+    op.create_index(op.f('ix_notes_title'), 'notes', ['title'], unique=False)
+    op.create_index('ix_notes_owner_id_created_at', 'notes', ['owner_id', 'created_at', 'id'], unique=False)
+
+    op.rename_table('shared_notes_unpartitioned', 'shared_notes')
+    op.execute("ALTER TABLE shared_notes RENAME CONSTRAINT shared_notes_unpartitioned_pkey TO shared_notes_pkey")
+    op.create_index(op.f('ix_shared_notes_created_at'), 'shared_notes', ['created_at'], unique=False)
+    op.create_index(op.f('ix_shared_notes_permission'), 'shared_notes', ['permission'], unique=False)
+
+    op.execute("""
+    CREATE TRIGGER notes_count
+    AFTER INSERT OR DELETE OR UPDATE OF owner_id ON notes
+    FOR EACH ROW EXECUTE FUNCTION notes_count_trigger();
+    """)
+    op.execute("""
+    CREATE TRIGGER shared_notes_count
+    AFTER INSERT OR DELETE ON shared_notes
+    FOR EACH ROW EXECUTE FUNCTION shared_notes_count_trigger();
+    """)
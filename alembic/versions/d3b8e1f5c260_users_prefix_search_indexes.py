@@ -0,0 +1,31 @@
+"""users prefix search indexes
+
+Revision ID: d3b8e1f5c260
+Revises: a2f7c9e4b318
+Create Date: 2024-03-16 09:12:44.716203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3b8e1f5c260'
+down_revision: Union[str, None] = 'a2f7c9e4b318'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Built concurrently so signups and logins keep working on a big table
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_lower_username', 'users', [sa.text('lower(username) COLLATE "C"')], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_users_lower_email', 'users', [sa.text('lower(email) COLLATE "C"')], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_lower_email', table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_users_lower_username', table_name='users', postgresql_concurrently=True)
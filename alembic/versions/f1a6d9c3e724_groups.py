@@ -0,0 +1,126 @@
+"""groups
+
+Revision ID: f1a6d9c3e724
+Revises: d3b8e1f5c260
+Create Date: 2024-03-23 15:27:53.402961
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1a6d9c3e724'
+down_revision: Union[str, None] = 'd3b8e1f5c260'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+permissions = postgresql.ENUM('edit', 'read_only', name='permissions', create_type=False)
+
+
+def upgrade() -> None:
+    op.create_table('groups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_groups_owner_id'), 'groups', ['owner_id'], unique=False)
+    op.create_table('group_members',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('sync_version', sa.BigInteger(), server_default=sa.text("nextval('sync_version_seq')"), nullable=False),
+    sa.Column('sync_xid', sa.BigInteger(), server_default=sa.text('pg_current_xact_id()::text::bigint'), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'group_id')
+    )
+    op.create_index(op.f('ix_group_members_group_id'), 'group_members', ['group_id'], unique=False)
+    op.create_table('group_shared_notes',
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.Column('note_owner_id', sa.Integer(), nullable=False),
+    sa.Column('permission', permissions, nullable=False),
+    sa.Column('sync_version', sa.BigInteger(), server_default=sa.text("nextval('sync_version_seq')"), nullable=False),
+    sa.Column('sync_xid', sa.BigInteger(), server_default=sa.text('pg_current_xact_id()::text::bigint'), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['note_id', 'note_owner_id'], ['notes.id', 'notes.owner_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('group_id', 'note_id')
+    )
+    op.create_index(op.f('ix_group_shared_notes_note_id'), 'group_shared_notes', ['note_id'], unique=False)
+    op.create_table('group_note_tombstones',
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('sync_version', sa.BigInteger(), server_default=sa.text("nextval('sync_version_seq')"), nullable=False),
+    sa.Column('sync_xid', sa.BigInteger(), server_default=sa.text('pg_current_xact_id()::text::bigint'), nullable=False),
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('group_id', 'sync_version')
+    )
+    op.create_index('ix_group_note_tombstones_group_id_sync_xid', 'group_note_tombstones', ['group_id', 'sync_xid', 'sync_version'], unique=False)
+
+    # Unsharing leaves one tombstone for the group, members read it through
+    # their membership. A member that leaves gets one per note of the group
+    # they do not own.
+    # Groups and users that are being deleted themselves get none.
+    op.execute("""
+    CREATE OR REPLACE FUNCTION group_note_tombstone_trigger() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO group_note_tombstones (group_id, note_id)
+        SELECT OLD.group_id, OLD.note_id
+        WHERE EXISTS (SELECT 1 FROM groups WHERE id = OLD.group_id);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION group_member_tombstone_trigger() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO note_tombstones (user_id, note_id)
+        SELECT OLD.user_id, group_shared_notes.note_id
+        FROM group_shared_notes
+        WHERE group_shared_notes.group_id = OLD.group_id
+          AND group_shared_notes.note_owner_id <> OLD.user_id
+          AND EXISTS (SELECT 1 FROM users WHERE id = OLD.user_id);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE TRIGGER group_shared_notes_touch
+    BEFORE UPDATE ON group_shared_notes
+    FOR EACH ROW EXECUTE FUNCTION shared_notes_touch_trigger();
+    """)
+    op.execute("""
+    CREATE TRIGGER group_shared_notes_tombstone
+    AFTER DELETE ON group_shared_notes
+    FOR EACH ROW EXECUTE FUNCTION group_note_tombstone_trigger();
+    """)
+    op.execute("""
+    CREATE TRIGGER group_members_tombstone
+    AFTER DELETE ON group_members
+    FOR EACH ROW EXECUTE FUNCTION group_member_tombstone_trigger();
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS group_members_tombstone ON group_members")
+    op.execute("DROP TRIGGER IF EXISTS group_shared_notes_tombstone ON group_shared_notes")
+    op.execute("DROP TRIGGER IF EXISTS group_shared_notes_touch ON group_shared_notes")
+    op.execute("DROP FUNCTION IF EXISTS group_member_tombstone_trigger()")
+    op.execute("DROP FUNCTION IF EXISTS group_note_tombstone_trigger()")
+    op.drop_index('ix_group_note_tombstones_group_id_sync_xid', table_name='group_note_tombstones')
+    op.drop_table('group_note_tombstones')
+    op.drop_index(op.f('ix_group_shared_notes_note_id'), table_name='group_shared_notes')
+    op.drop_table('group_shared_notes')
+    op.drop_index(op.f('ix_group_members_group_id'), table_name='group_members')
+    op.drop_table('group_members')
+    op.drop_index(op.f('ix_groups_owner_id'), table_name='groups')
+    op.drop_table('groups')
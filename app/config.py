@@ -1,3 +1,5 @@
+from typing import Dict
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -12,6 +14,21 @@ class Settings(BaseSettings):
     algorithm: str
     access_expire_minutes: int
     refresh_expire_minutes: int
+    acl_cache_size: int = 10000
+    compression_minimum_size: int = 1024
+    # Postgres statement_timeout in milliseconds, overridable per GraphQL
+    # operation name, e.g. OPERATION_TIMEOUTS='{"SearchNotes": 2000}'
+    statement_timeout_ms: int = 10000
+    operation_timeouts: Dict[str, int] = {}
+    prepare_threshold: int = 2
+    autosave_delay_seconds: float = 5.0
+    concurrency_initial_limit: int = 20
+    concurrency_min_limit: int = 5
+    concurrency_max_limit: int = 200
+    loop_lag_interval_seconds: float = 0.1
+    loop_block_threshold_seconds: float = 0.25
+    user_search_cache_size: int = 1024
+    user_search_cache_ttl: float = 30.0
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
@@ -1,16 +1,127 @@
-from sqlalchemy import create_engine, engine
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Union
+
+from psycopg.rows import namedtuple_row
+from sqlalchemy import create_engine, engine, event
 from sqlalchemy.engine import base
 from sqlalchemy.orm import sessionmaker, declarative_base
 from .config import settings
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}/{settings.database_name}"
+SQLALCHEMY_DATABASE_URL = f"postgresql+psycopg://{settings.database_username}:{settings.database_password}@{settings.database_hostname}/{settings.database_name}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+# psycopg 3 binds parameters server side, so helper queries that repeat with
+# the same SQL text are prepared after prepare_threshold executions
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    echo=True,
+    connect_args={"prepare_threshold": settings.prepare_threshold},
+)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 
 Base = declarative_base()
 
+# statement_timeout (ms) for queries issued by the current request, or a
+# callable returning it for loads shared by several requests
+statement_timeout: ContextVar[Optional[Union[int, Callable[[], int]]]] = ContextVar(
+    "statement_timeout", default=None
+)
+# DBAPI connections currently running a statement for the current request,
+# so they can be cancelled when its client goes away
+inflight_connections: ContextVar[Optional[set]] = ContextVar(
+    "inflight_connections", default=None
+)
+
+
+def _apply_request_settings(info, dbapi_connection, cursor):
+    timeout = statement_timeout.get()
+    if callable(timeout):
+        timeout = timeout()
+    if timeout is None:
+        timeout = settings.statement_timeout_ms
+    # Only pay the extra SET when the pooled connection has another value
+    if info.get("statement_timeout") != timeout:
+        cursor.execute(f"SET statement_timeout = {int(timeout)}")
+        info["statement_timeout"] = timeout
+
+    connections = inflight_connections.get()
+    if connections is not None:
+        connections.add(dbapi_connection)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def apply_statement_timeout(conn, cursor, statement, parameters, context, executemany):
+    _apply_request_settings(conn.info, conn.connection.dbapi_connection, cursor)
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def release_inflight_connection(
+    conn, cursor, statement, parameters, context, executemany
+):
+    connections = inflight_connections.get()
+    if connections is not None:
+        connections.discard(conn.connection.dbapi_connection)
+
+
+@event.listens_for(engine, "handle_error")
+def release_failed_connection(context):
+    connections = inflight_connections.get()
+    if connections is not None and context.connection is not None:
+        connections.discard(context.connection.connection.dbapi_connection)
+
+
+@event.listens_for(engine, "rollback")
+def forget_statement_timeout(conn):
+    # A rollback also undoes a SET issued inside the transaction
+    conn.info.pop("statement_timeout", None)
+
+
+def pipeline(db, *statements) -> List[list]:
+    """Runs independent SELECTs in a single round trip.
+
+    The statements are sent back to back in psycopg's pipeline mode and
+    their rows are returned as named tuples, one list per statement. They
+    bypass the ORM, so only plain columns and parameters should be used.
+    """
+    connection = db.connection()
+    dbapi_connection = connection.connection.dbapi_connection
+    cursors = []
+    try:
+        with dbapi_connection.pipeline():
+            with dbapi_connection.cursor() as cursor:
+                _apply_request_settings(connection.info, dbapi_connection, cursor)
+            for statement in statements:
+                compiled = statement.compile(
+                    dialect=connection.dialect,
+                    compile_kwargs={"render_postcompile": True},
+                )
+                cursor = dbapi_connection.cursor(row_factory=namedtuple_row)
+                cursor.execute(str(compiled), compiled.construct_params())
+                cursors.append(cursor)
+        return [cursor.fetchall() for cursor in cursors]
+    finally:
+        for cursor in cursors:
+            cursor.close()
+        connections = inflight_connections.get()
+        if connections is not None:
+            connections.discard(dbapi_connection)
+
+
+@contextmanager
+def session_scope(db=None):
+    """Yields `db`, or a session of its own that is closed afterwards.
+
+    Statements can be cancelled (statement_timeout, client disconnects), so
+    helpers must not share one long-lived session: a failed transaction
+    would poison every later call and keep its transaction id running.
+    """
+    if db is not None:
+        yield db
+        return
+    with SessionLocal() as db:
+        yield db
+
 
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,449 @@
+import asyncio
+import inspect
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+from graphql import (
+    FieldNode,
+    GraphQLError,
+    GraphQLList,
+    GraphQLNonNull,
+    GraphQLObjectType,
+    GraphQLResolveInfo,
+    GraphQLSchema,
+    DocumentNode,
+    OperationDefinitionNode,
+    OperationType as CoreOperationType,
+    is_leaf_type,
+    located_error,
+    parse,
+    validate,
+)
+from graphql.execution.values import get_argument_values, get_variable_values
+from graphql.pyutils import Path, Undefined, inspect as inspect_value
+from strawberry import Schema
+from strawberry.extensions import SchemaExtension
+from strawberry.extensions.runner import SchemaExtensionsRunner
+from strawberry.types import ExecutionContext, ExecutionResult
+from strawberry.types.graphql import OperationType
+
+from app.extensions import StatementTimeoutExtension
+
+DEFINITION_BACKREF = "strawberry-definition"
+
+# Extensions whose on_operation and on_execute hooks are all they need. Any
+# other one may parse, validate or wrap resolvers, which a compiled operation
+# skips, so schemas using one never compile.
+COMPILED_EXTENSIONS = (StatementTimeoutExtension,)
+
+
+class NotCompilable(Exception):
+    """The operation uses something the compiled executor does not handle."""
+
+
+class FallBack(Exception):
+    """The standard executor must produce this result (invalid variables)."""
+
+
+class FieldPlan:
+    __slots__ = (
+        "key",
+        "name",
+        "field_def",
+        "node",
+        "attribute",
+        "complete",
+        "non_null",
+    )
+
+    def __init__(self, key, name, field_def, node, attribute, complete) -> None:
+        self.key = key
+        self.name = name
+        self.field_def = field_def
+        self.node = node
+        # Set for basic strawberry fields, which are read straight off the
+        # source without building an info object or calling a resolver
+        self.attribute = attribute
+        self.complete = complete
+        self.non_null = field_def is not None and isinstance(
+            field_def.type, GraphQLNonNull
+        )
+
+
+class CompiledOperation:
+    """A query specialized once into plain attribute reads and serializers.
+
+    Root fields go through their resolvers as usual; below them every basic
+    field is a getattr plus the scalar's serialize. Field errors are located
+    and nulls propagated the way graphql-core does it, so the response is
+    the one the standard executor would produce.
+    """
+
+    def __init__(
+        self,
+        schema: GraphQLSchema,
+        document: DocumentNode,
+        operation: OperationDefinitionNode,
+    ):
+        self.schema = schema
+        self.document = document
+        self.operation = operation
+        self.name = operation.name.value if operation.name else None
+        self.root_type = schema.query_type
+        self.root_fields = self._compile_selection(
+            self.root_type, operation.selection_set
+        )
+
+    def _compile_selection(self, parent_type, selection_set) -> List[FieldPlan]:
+        plans = []
+        for node in selection_set.selections:
+            if not isinstance(node, FieldNode) or node.directives:
+                raise NotCompilable()
+            name = node.name.value
+            key = node.alias.value if node.alias else name
+            if name == "__typename":
+                typename = parent_type.name
+                plans.append(
+                    FieldPlan(key, name, None, node, None, lambda _v, _r, _p: typename)
+                )
+                continue
+            field_def = parent_type.fields.get(name)
+            if field_def is None:
+                raise NotCompilable()
+            definition = field_def.extensions.get(DEFINITION_BACKREF)
+            attribute = None
+            if definition is not None and definition.is_basic_field:
+                attribute = definition.python_name
+            label = f"{parent_type.name}.{name}"
+            complete = self._compile_type(field_def.type, node, label)
+            plans.append(FieldPlan(key, name, field_def, node, attribute, complete))
+        return plans
+
+    def _compile_type(self, type_, node: FieldNode, label: str):
+        if isinstance(type_, GraphQLNonNull):
+            complete_inner = self._compile_type(type_.of_type, node, label)
+
+            def complete_non_null(value, run, path):
+                completed = complete_inner(value, run, path)
+                if completed is None:
+                    raise TypeError(
+                        f"Cannot return null for non-nullable field {label}."
+                    )
+                return completed
+
+            return complete_non_null
+
+        if isinstance(type_, GraphQLList):
+            complete_item = self._compile_type(type_.of_type, node, label)
+            item_non_null = isinstance(type_.of_type, GraphQLNonNull)
+
+            def complete_list(value, run, path):
+                if value is None:
+                    return None
+                completed = []
+                for index, item in enumerate(value):
+                    item_path = path.add_key(index, None)
+                    try:
+                        completed.append(complete_item(item, run, item_path))
+                    except NotCompilable:
+                        raise
+                    except Exception as error:
+                        completed.append(
+                            run.field_error(error, node, item_path, item_non_null)
+                        )
+                return completed
+
+            return complete_list
+
+        if is_leaf_type(type_):
+            serialize = type_.serialize
+
+            def complete_leaf(value, run, path):
+                if value is None:
+                    return None
+                serialized = serialize(value)
+                if serialized is Undefined or serialized is None:
+                    raise TypeError(
+                        f"Expected `{inspect_value(type_)}.serialize"
+                        f"({inspect_value(value)})` to return non-nullable value,"
+                        f" returned: {inspect_value(serialized)}"
+                    )
+                return serialized
+
+            return complete_leaf
+
+        # Types with an is_type_of check are left to the standard executor
+        if (
+            isinstance(type_, GraphQLObjectType)
+            and node.selection_set
+            and type_.is_type_of is None
+        ):
+            fields = self._compile_selection(type_, node.selection_set)
+
+            def complete_object(value, run, path):
+                if value is None:
+                    return None
+                return run.resolve_fields(fields, type_, value, path)
+
+            return complete_object
+
+        raise NotCompilable()
+
+    async def execute(
+        self, context_value, root_value, variable_values
+    ) -> ExecutionResult:
+        variables = get_variable_values(
+            self.schema,
+            self.operation.variable_definitions or (),
+            variable_values or {},
+        )
+        if isinstance(variables, list):
+            raise FallBack()
+        run = Run(self, context_value, root_value, variables)
+
+        try:
+            values = await asyncio.gather(
+                *(run.resolve_root(plan) for plan in self.root_fields)
+            )
+            data = dict(zip((plan.key for plan in self.root_fields), values))
+        except GraphQLError as error:
+            # A null reached a non-null root field
+            run.errors.append(error)
+            data = None
+        return ExecutionResult(data=data, errors=run.errors or None)
+
+
+class Run:
+    """Per-request state of a CompiledOperation."""
+
+    __slots__ = ("compiled", "context", "root_value", "variables", "errors")
+
+    def __init__(self, compiled, context, root_value, variables) -> None:
+        self.compiled = compiled
+        self.context = context
+        self.root_value = root_value
+        self.variables = variables
+        self.errors: List[GraphQLError] = []
+
+    def field_error(self, error: Exception, node: FieldNode, path: Path, non_null):
+        """Records the error and nulls the field, or raises it to the parent."""
+        error = located_error(error, [node], path.as_list())
+        if non_null:
+            raise error
+        self.errors.append(error)
+        return None
+
+    def info(self, plan: FieldPlan, parent_type, path: Path) -> GraphQLResolveInfo:
+        compiled = self.compiled
+        return GraphQLResolveInfo(
+            plan.name,
+            [plan.node],
+            plan.field_def.type,
+            parent_type,
+            path,
+            compiled.schema,
+            {},
+            self.root_value,
+            compiled.operation,
+            self.variables,
+            self.context,
+            inspect.isawaitable,
+        )
+
+    def call(self, plan: FieldPlan, parent_type, source, path: Path):
+        args = get_argument_values(plan.field_def, plan.node, self.variables)
+        info = self.info(plan, parent_type, path)
+        return plan.field_def.resolve(source, info, **args)
+
+    async def resolve_root(self, plan: FieldPlan):
+        root_type = self.compiled.root_type
+        if plan.field_def is None:
+            return root_type.name
+        path = Path(None, plan.key, root_type.name)
+        try:
+            value = self.call(plan, root_type, self.root_value, path)
+            if inspect.isawaitable(value):
+                value = await value
+            return plan.complete(value, self, path)
+        except NotCompilable:
+            raise
+        except Exception as error:
+            return self.field_error(error, plan.node, path, plan.non_null)
+
+    def resolve_fields(
+        self, fields: List[FieldPlan], parent_type, source, path: Path
+    ) -> Dict:
+        result = {}
+        for plan in fields:
+            field_path = path.add_key(plan.key, parent_type.name)
+            try:
+                if plan.attribute is not None:
+                    value = getattr(source, plan.attribute)
+                elif plan.field_def is None:
+                    value = None
+                else:
+                    value = self.call(plan, parent_type, source, field_path)
+                    if inspect.isawaitable(value):
+                        # Nested async resolvers are left to the standard executor
+                        value.close()
+                        raise NotCompilable()
+                result[plan.key] = plan.complete(value, self, field_path)
+            except NotCompilable:
+                raise
+            except Exception as error:
+                result[plan.key] = self.field_error(
+                    error, plan.node, field_path, plan.non_null
+                )
+        return result
+
+
+class CompilingSchema(Schema):
+    """Schema that compiles its hottest query documents.
+
+    Operations passed to `register` are compiled up front; any other query
+    is compiled once it has been executed `hot_threshold` times. Documents
+    that cannot be compiled, mutations and invalid variables go through the
+    standard strawberry executor; field errors are reported by the compiled
+    one without running the query again. Nothing is compiled while the
+    schema has extensions outside COMPILED_EXTENSIONS.
+    """
+
+    def __init__(self, *args, hot_threshold: int = 20, max_plans: int = 256, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hot_threshold = hot_threshold
+        self.max_plans = max_plans
+        self._plans: "OrderedDict[Any, Optional[CompiledOperation]]" = OrderedDict()
+        self._hits: "OrderedDict[Any, int]" = OrderedDict()
+        self._compilable = all(
+            _extension_type(extension) in COMPILED_EXTENSIONS
+            for extension in self.get_extensions()
+        )
+
+    def register(self, query: str, operation_name: Optional[str] = None):
+        self._store((query, operation_name), self._compile(query, operation_name))
+
+    def _compile(self, query: str, operation_name: Optional[str]):
+        if not self._compilable:
+            return None
+        try:
+            document = parse(query)
+        except GraphQLError:
+            return None
+        if validate(self._schema, document):
+            return None
+        operations = [
+            definition
+            for definition in document.definitions
+            if isinstance(definition, OperationDefinitionNode)
+        ]
+        if len(operations) != len(document.definitions):
+            # Fragment definitions
+            return None
+        if operation_name is not None:
+            operations = [
+                operation
+                for operation in operations
+                if operation.name and operation.name.value == operation_name
+            ]
+        if len(operations) != 1 or operations[0].operation != CoreOperationType.QUERY:
+            return None
+        try:
+            return CompiledOperation(self._schema, document, operations[0])
+        except NotCompilable:
+            return None
+
+    def _store(self, key, plan):
+        self._plans[key] = plan
+        self._plans.move_to_end(key)
+        while len(self._plans) > self.max_plans:
+            self._plans.popitem(last=False)
+
+    def _plan_for(self, query: Optional[str], operation_name: Optional[str]):
+        if not query:
+            return None
+        key = (query, operation_name)
+        if key in self._plans:
+            self._plans.move_to_end(key)
+            return self._plans[key]
+        hits = self._hits.pop(key, 0) + 1
+        if hits < self.hot_threshold:
+            self._hits[key] = hits
+            while len(self._hits) > self.max_plans:
+                self._hits.popitem(last=False)
+            return None
+        plan = self._compile(query, operation_name)
+        self._store(key, plan)
+        return plan
+
+    async def execute(
+        self,
+        query: Optional[str],
+        variable_values: Optional[Dict[str, Any]] = None,
+        context_value: Optional[Any] = None,
+        root_value: Optional[Any] = None,
+        operation_name: Optional[str] = None,
+        allowed_operation_types: Optional[Iterable[OperationType]] = None,
+    ) -> ExecutionResult:
+        plan = self._plan_for(query, operation_name)
+        if plan is not None and (
+            allowed_operation_types is None
+            or OperationType.QUERY in allowed_operation_types
+        ):
+            try:
+                result = await self._execute_plan(
+                    plan,
+                    query,
+                    variable_values=variable_values,
+                    context_value=context_value,
+                    root_value=root_value,
+                    operation_name=operation_name,
+                )
+            except NotCompilable:
+                # Only found out at run time, resolvers may already have run
+                self._store((query, operation_name), None)
+            except FallBack:
+                pass
+            else:
+                if result.errors:
+                    self.process_errors(result.errors)
+                return result
+        return await super().execute(
+            query,
+            variable_values=variable_values,
+            context_value=context_value,
+            root_value=root_value,
+            operation_name=operation_name,
+            allowed_operation_types=allowed_operation_types,
+        )
+
+    async def _execute_plan(
+        self,
+        plan: CompiledOperation,
+        query: str,
+        variable_values: Optional[Dict[str, Any]],
+        context_value: Optional[Any],
+        root_value: Optional[Any],
+        operation_name: Optional[str],
+    ) -> ExecutionResult:
+        """Runs a compiled operation inside the extensions' hooks."""
+        execution_context = ExecutionContext(
+            query=query,
+            schema=self,
+            context=context_value,
+            root_value=root_value,
+            variables=variable_values,
+            provided_operation_name=operation_name,
+        )
+        execution_context.graphql_document = plan.document
+        extensions = SchemaExtensionsRunner(execution_context, self.get_extensions())
+        async with extensions.operation():
+            async with extensions.executing():
+                result = await plan.execute(context_value, root_value, variable_values)
+            execution_context.errors = result.errors
+        return result
+
+
+def _extension_type(extension) -> Type[SchemaExtension]:
+    if isinstance(extension, SchemaExtension):
+        return type(extension)
+    return extension
@@ -0,0 +1,22 @@
+from typing import Optional
+
+from strawberry.extensions import SchemaExtension
+
+from app.config import settings
+from app.database import statement_timeout
+
+
+def operation_timeout(operation_name: Optional[str]) -> int:
+    return settings.operation_timeouts.get(operation_name, settings.statement_timeout_ms)
+
+
+class StatementTimeoutExtension(SchemaExtension):
+    """Bounds the queries of each operation by its configured timeout."""
+
+    def on_execute(self):
+        operation_name = self.execution_context.operation_name
+        token = statement_timeout.set(operation_timeout(operation_name))
+        try:
+            yield
+        finally:
+            statement_timeout.reset(token)
@@ -0,0 +1,203 @@
+import json
+import logging
+import select as select_module
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from sqlalchemy import String, cast, func, literal, select, union_all
+from sqlalchemy.orm.session import Session
+
+from app.config import settings
+from app.database import engine
+from app.models import GroupMember, GroupSharedNotes, Note, SharedNotes
+
+logger = logging.getLogger(__name__)
+
+ACL_CHANNEL = "note_acl"
+
+# A user shared a note several ways gets the strongest of the permissions
+PERMISSION_RANK = {"read_only": 0, "edit": 1, "owner": 2}
+
+
+class AclCache:
+    """Per-worker LRU of (note_id, user_id) -> (permission, note owner_id).
+
+    The permission is "owner", "edit" or "read_only"; the owner id is kept
+    alongside since it is the partition key every note lookup needs.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._by_note = {}
+        self._by_user = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, a load that started before one must
+        # not store what it read
+        self.generation = 0
+
+    def get(self, note_id: int, user_id: int) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            access = self._entries.get((note_id, user_id))
+            if access is not None:
+                self._entries.move_to_end((note_id, user_id))
+            return access
+
+    def set(
+        self,
+        note_id: int,
+        user_id: int,
+        access: Tuple[str, int],
+        generation: Optional[int] = None,
+    ):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[(note_id, user_id)] = access
+            self._entries.move_to_end((note_id, user_id))
+            self._by_note.setdefault(note_id, set()).add(user_id)
+            self._by_user.setdefault(user_id, set()).add(note_id)
+            while len(self._entries) > self.maxsize:
+                (old_note_id, old_user_id), _ = self._entries.popitem(last=False)
+                self._forget(old_note_id, old_user_id)
+
+    def invalidate(self, note_id: int, user_id: Optional[int] = None):
+        with self._lock:
+            self.generation += 1
+            if user_id is not None:
+                self._entries.pop((note_id, user_id), None)
+                self._forget(note_id, user_id)
+                return
+            for cached_user_id in list(self._by_note.get(note_id, ())):
+                self._entries.pop((note_id, cached_user_id), None)
+                self._forget(note_id, cached_user_id)
+
+    def invalidate_user(self, user_id: int):
+        """Drops every note of the user, e.g. after a group membership change."""
+        with self._lock:
+            self.generation += 1
+            for note_id in list(self._by_user.get(user_id, ())):
+                self._entries.pop((note_id, user_id), None)
+                self._forget(note_id, user_id)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_note.clear()
+            self._by_user.clear()
+
+    def _forget(self, note_id: int, user_id: int):
+        users = self._by_note.get(note_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._by_note[note_id]
+        notes = self._by_user.get(user_id)
+        if notes is not None:
+            notes.discard(note_id)
+            if not notes:
+                del self._by_user[user_id]
+
+
+acl_cache = AclCache(maxsize=settings.acl_cache_size)
+
+
+def get_access(db: Session, note_id: int, user_id: int) -> Optional[Tuple[str, int]]:
+    """Returns (permission, note owner_id), or None without access."""
+    access = acl_cache.get(note_id, user_id)
+    if access is not None:
+        return access
+    generation = acl_cache.generation
+
+    # The owned and shared branches carry their table's partition key, the
+    # group branch goes through the user's memberships
+    owned = select(literal("owner", String), Note.owner_id).where(
+        Note.id == note_id, Note.owner_id == user_id
+    )
+    shared = select(
+        cast(SharedNotes.permission, String), SharedNotes.note_owner_id
+    ).where(SharedNotes.user_id == user_id, SharedNotes.note_id == note_id)
+    grouped = (
+        select(
+            cast(GroupSharedNotes.permission, String), GroupSharedNotes.note_owner_id
+        )
+        .join(GroupMember, GroupMember.group_id == GroupSharedNotes.group_id)
+        .where(GroupMember.user_id == user_id, GroupSharedNotes.note_id == note_id)
+    )
+    rows = db.execute(union_all(owned, shared, grouped)).all()
+    if not rows:
+        # Missing access is not cached, a later share only has to invalidate
+        return None
+    row = max(rows, key=lambda row: PERMISSION_RANK[row[0]])
+    access = (row[0], row[1])
+    acl_cache.set(note_id, user_id, access, generation)
+    return access
+
+
+def get_permission(db: Session, note_id: int, user_id: int) -> Optional[str]:
+    access = get_access(db, note_id, user_id)
+    return access[0] if access else None
+
+
+def acl_notification(note_id: Optional[int], user_id: Optional[int] = None):
+    """pg_notify() expression invalidating (note_id, user_id) in every worker.
+
+    A note_id of None invalidates all of the user's notes. Select it in the
+    statement that changes the permissions so the notification is only
+    delivered once that change commits.
+    """
+    return func.pg_notify(
+        ACL_CHANNEL, json.dumps({"note_id": note_id, "user_id": user_id})
+    )
+
+
+class AclListener(threading.Thread):
+    """LISTENs on ACL_CHANNEL and applies invalidations from other workers."""
+
+    def __init__(self, poll_interval: float = 5.0, retry_interval: float = 1.0):
+        super().__init__(name="acl-listener", daemon=True)
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("ACL listener lost its connection")
+            # Notifications may have been missed while disconnected
+            acl_cache.clear()
+            self._stop_event.wait(self.retry_interval)
+
+    def _listen(self):
+        raw = engine.raw_connection()
+        raw.detach()
+        conn = raw.driver_connection
+        try:
+            conn.autocommit = True
+            conn.add_notify_handler(self._handle)
+            conn.execute(f"LISTEN {ACL_CHANNEL}")
+            while not self._stop_event.is_set():
+                if select_module.select([conn], [], [], self.poll_interval)[0] == []:
+                    continue
+                # psycopg dispatches notifications to handlers whenever it
+                # reads from the socket, so a round trip drains them
+                conn.execute("SELECT 1")
+        finally:
+            raw.close()
+
+    def _handle(self, notify):
+        payload = json.loads(notify.payload)
+        if payload["note_id"] is None:
+            acl_cache.invalidate_user(payload["user_id"])
+        else:
+            acl_cache.invalidate(payload["note_id"], payload["user_id"])
+
+
+acl_listener = AclListener()
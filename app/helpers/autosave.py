@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.types.rows import NoteRow
+
+logger = logging.getLogger(__name__)
+
+
+class PendingSave:
+    __slots__ = ("user_id", "note")
+
+    def __init__(self, user_id: int, note: NoteRow) -> None:
+        self.user_id = user_id
+        self.note = note
+
+
+class AutosaveBuffer:
+    """Holds the latest autosaved version of each note until it is flushed.
+
+    A note is written at most once per `delay` seconds after its first
+    buffered change; intermediate versions are never written. Buffers are
+    per worker, so only readers served by the same worker see them.
+    """
+
+    def __init__(self, delay: float, write: Callable) -> None:
+        self.delay = delay
+        # write(user_id, note) runs in the threadpool and returns the note's
+        # new sync_version, or None when the note changed since note.sync_version
+        self.write = write
+        self._pending: Dict[int, PendingSave] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._flushing: Dict[int, asyncio.Task] = {}
+
+    def pending(self, note_id: int) -> Optional[PendingSave]:
+        return self._pending.get(note_id)
+
+    def save(self, user_id: int, note: NoteRow):
+        self._pending[note.id] = PendingSave(user_id, note)
+        if note.id not in self._timers:
+            self._timers[note.id] = asyncio.get_running_loop().call_later(
+                self.delay, self._schedule_flush, note.id
+            )
+
+    def overlay(self, note: NoteRow) -> NoteRow:
+        pending = self._pending.get(note.id)
+        return pending.note if pending else note
+
+    async def discard(self, note_id: int):
+        """Drops the buffered version, waiting for any write already running."""
+        self._pending.pop(note_id, None)
+        timer = self._timers.pop(note_id, None)
+        if timer:
+            timer.cancel()
+        flushing = self._flushing.get(note_id)
+        if flushing:
+            await asyncio.shield(flushing)
+
+    async def flush(self, note_id: int):
+        timer = self._timers.pop(note_id, None)
+        if timer:
+            timer.cancel()
+        # Writes of the same note must land in order
+        previous = self._flushing.get(note_id)
+        if previous:
+            await asyncio.shield(previous)
+        pending = self._pending.pop(note_id, None)
+        if not pending:
+            return
+        task = asyncio.ensure_future(
+            run_in_threadpool(self.write, pending.user_id, pending.note)
+        )
+        self._flushing[note_id] = task
+        try:
+            written = await asyncio.shield(task)
+        except Exception:
+            logger.exception("Failed to flush autosaved note %s", note_id)
+        else:
+            # A change buffered while this one was written started from the
+            # same version, it now has to overwrite the one just written
+            newer = self._pending.get(note_id)
+            if (
+                written is not None
+                and newer is not None
+                and newer.note.sync_version == pending.note.sync_version
+            ):
+                newer.note.sync_version = written
+        finally:
+            if self._flushing.get(note_id) is task:
+                del self._flushing[note_id]
+
+    async def flush_all(self):
+        await asyncio.gather(*(self.flush(note_id) for note_id in list(self._pending)))
+
+    def _schedule_flush(self, note_id: int):
+        asyncio.ensure_future(self.flush(note_id))
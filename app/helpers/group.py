@@ -0,0 +1,148 @@
+from typing import Optional
+
+from sqlalchemy import delete, exists, insert, literal, select, true
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.session import Session
+
+from app.database import session_scope
+from app.helpers.acl import acl_cache, acl_notification
+from app.models import Group, GroupMember, User
+from app.types.rows import GroupRow
+
+
+def _owns_group(db: Session, current_user, group_id: int) -> bool:
+    return bool(
+        db.query(Group.id)
+        .filter(Group.id == group_id, Group.owner_id == current_user.id)
+        .first()
+    )
+
+
+async def create_group(
+    current_user,
+    name: str,
+    db: Optional[Session] = None,
+):
+    with session_scope(db) as db:
+        # The owner is the first member, so they see what is shared with it
+        created = (
+            insert(Group)
+            .values(name=name, owner_id=current_user.id)
+            .returning(Group.id, Group.name, Group.owner_id)
+            .cte("created")
+        )
+        member = (
+            insert(GroupMember)
+            .from_select(
+                ["user_id", "group_id"], select(literal(current_user.id), created.c.id)
+            )
+            .returning(GroupMember.group_id)
+            .cte("member")
+        )
+        try:
+            row = db.execute(
+                select(created).join(member, member.c.group_id == created.c.id)
+            ).first()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise Exception(
+                str(e),
+            )
+        return GroupRow(row.id, row.name, row.owner_id)
+
+
+async def add_group_member(
+    current_user,
+    group_id: int,
+    user_id: int,
+    db: Optional[Session] = None,
+):
+    with session_scope(db) as db:
+        added = (
+            insert(GroupMember)
+            .from_select(
+                ["user_id", "group_id"],
+                select(literal(user_id), Group.id).where(
+                    Group.id == group_id, Group.owner_id == current_user.id
+                ),
+            )
+            .returning(GroupMember.group_id)
+            .cte("added")
+        )
+        try:
+            # Cached permissions of the new member may be weaker than the group's
+            row = db.execute(
+                select(
+                    Group.id,
+                    Group.name,
+                    Group.owner_id,
+                    acl_notification(None, user_id).label("acl_notified"),
+                ).join(added, added.c.group_id == Group.id)
+            ).first()
+        except IntegrityError as e:
+            db.rollback()
+            if "duplicate key" in str(e):
+                username = db.query(User.username).filter(User.id == user_id).scalar()
+                raise Exception(
+                    f"{username} is already a member of group {group_id}",
+                )
+            if "foreign key" in str(e):
+                raise Exception(
+                    f"User with id {user_id} Does not Exist",
+                )
+            raise Exception(
+                str(e),
+            )
+        if not row:
+            db.rollback()
+            raise Exception(
+                f"Group with id {group_id} Does not Exist",
+            )
+        acl_cache.invalidate_user(user_id)
+        db.commit()
+        return GroupRow(row.id, row.name, row.owner_id)
+
+
+async def remove_group_member(
+    current_user,
+    group_id: int,
+    user_id: int,
+    db: Optional[Session] = None,
+):
+    with session_scope(db) as db:
+        # Owners remove anyone, members may only leave
+        if user_id == current_user.id:
+            allowed = true()
+        else:
+            allowed = exists().where(
+                Group.id == group_id, Group.owner_id == current_user.id
+            )
+        removed = (
+            delete(GroupMember)
+            .where(
+                GroupMember.group_id == group_id,
+                GroupMember.user_id == user_id,
+                allowed,
+            )
+            .returning(GroupMember.group_id)
+            .cte("removed")
+        )
+        row = db.execute(
+            select(acl_notification(None, user_id)).select_from(removed)
+        ).first()
+        if not row:
+            db.rollback()
+            if user_id != current_user.id and not _owns_group(
+                db, current_user, group_id
+            ):
+                raise Exception(
+                    f"Group with id {group_id} not found.",
+                )
+            raise Exception(
+                f"User {user_id} is not a member of group {group_id}.",
+            )
+        acl_cache.invalidate_user(user_id)
+        db.commit()
+
+        return
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _describe(frame) -> str:
+    """Names the GraphQL operation or HTTP request a loop frame serves."""
+    path = None
+    while frame is not None:
+        local_vars = frame.f_locals
+        operation = getattr(local_vars.get("info"), "operation", None)
+        if operation is not None:
+            name = operation.name.value if operation.name else "anonymous"
+            return f"GraphQL operation {name}"
+        scope = local_vars.get("scope")
+        if path is None and isinstance(scope, dict) and "path" in scope:
+            path = f"{scope.get('method', '')} {scope['path']}".strip()
+        frame = frame.f_back
+    return path or "no request"
+
+
+class LoopLagMonitor:
+    """Samples event loop lag and reports what blocks the loop.
+
+    A task on the loop sleeps for `interval` and records how late it wakes
+    up. A watchdog thread notices when those wakeups stop for longer than
+    `block_threshold` and logs the loop thread's stack while it is still
+    stuck, with the GraphQL operation (or request) it is serving.
+    """
+
+    # Upper bounds of the lag histogram, in seconds
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.25):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.bucket_counts = [0] * len(self.BUCKETS)
+        self.lag_sum = 0.0
+        self.samples = 0
+        self.last_lag = 0.0
+        self.blocked = 0
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Starts sampling; must be called from the running event loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._task:
+            self._task.cancel()
+
+    def observe(self, lag: float):
+        self.last_lag = lag
+        self.lag_sum += lag
+        self.samples += 1
+        for index, bound in enumerate(self.BUCKETS):
+            if lag <= bound:
+                self.bucket_counts[index] += 1
+                break
+
+    async def _sample(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            self.observe(max(0.0, self._beat - started - self.interval))
+
+    def _watch(self):
+        reported = None
+        while not self._stop_event.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            # One report per stall, taken while the loop is still inside it
+            if blocked > self.block_threshold and beat != reported:
+                reported = beat
+                self.blocked += 1
+                self._report(blocked)
+
+    def _report(self, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        logger.warning(
+            "Event loop blocked for %.3fs so far by %s\n%s",
+            blocked,
+            _describe(frame),
+            "".join(traceback.format_stack(frame)),
+        )
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP event_loop_lag_seconds How late event loop wakeups run.",
+            "# TYPE event_loop_lag_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(self.BUCKETS, self.bucket_counts):
+            cumulative += count
+            lines.append(f'event_loop_lag_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f'event_loop_lag_seconds_bucket{{le="+Inf"}} {self.samples}',
+            f"event_loop_lag_seconds_sum {self.lag_sum}",
+            f"event_loop_lag_seconds_count {self.samples}",
+            "# HELP event_loop_last_lag_seconds Lag of the latest sample.",
+            "# TYPE event_loop_last_lag_seconds gauge",
+            f"event_loop_last_lag_seconds {self.last_lag}",
+            "# HELP event_loop_blocked_total Stalls longer than the threshold.",
+            "# TYPE event_loop_blocked_total counter",
+            f"event_loop_blocked_total {self.blocked}",
+        ]
+        return "\n".join(lines) + "\n"
@@ -1,175 +1,522 @@
 from sqlalchemy.orm.session import Session
-from sqlalchemy import desc, or_, func
+from sqlalchemy.orm import aliased
+from sqlalchemy import and_, desc, or_, func, select, insert, update, delete, exists
+from sqlalchemy import cast, literal, null, tuple_, union_all, BigInteger, String, Text
 from sqlalchemy.exc import IntegrityError
-from psycopg2.errors import UniqueViolation
-from typing import Optional, List
+from starlette.concurrency import run_in_threadpool
+from typing import NamedTuple, Optional, List, Tuple
+from datetime import datetime
+import base64
+import logging
 
-from app.database import SessionLocal
-from app.models import User, Note, SharedNotes
-from app.types.types import Participant
+from app.config import settings
+from app.database import SessionLocal, pipeline, session_scope
+from app.helpers.acl import acl_cache, acl_notification, get_access, get_permission
+from app.helpers.autosave import AutosaveBuffer
+from app.helpers.singleflight import read_flight
+from app.models import (
+    User,
+    Note,
+    SharedNotes,
+    NoteCounter,
+    NoteTombstone,
+    Group,
+    GroupMember,
+    GroupSharedNotes,
+    GroupNoteTombstone,
+)
+from app.types.rows import (
+    NoteRow,
+    UserRow,
+    ParticipantRow,
+    FeedItemRow,
+    GroupRow,
+    GroupShareRow,
+)
+from app.types.types import PREVIEW_LENGTH
 
+logger = logging.getLogger(__name__)
 
-def get_notes(
-    current_user: User,
-    q: Optional[str] = "",
-    page: Optional[int] = 1,
-    db: Session = SessionLocal(),
-):
+# Searches report at most this many matches, e.g. "100+"
+SEARCH_COUNT_CAP = 100
 
-    limit = 10
-    skip = (page - 1) * limit
+# Upper bound for the page size of feed()
+FEED_MAX_PAGE_SIZE = 50
 
-    # Count total notes meeting the criteria
-    total_notes = (
-        db.query(func.count(Note.id))
-        .filter(
-            Note.owner_id == current_user.id,
-            or_(
-                Note.title.ilike(f"%{q}%"),
-                Note.detail.ilike(f"%{q}%"),
-            ),
-        )
-        .scalar()
+# Upper bound for the number of changes per changes_since() call
+SYNC_MAX_PAGE_SIZE = 200
+
+# Read queries select these and map rows with _note_from_row
+OWNER_COLUMNS = (
+    User.username.label("owner_username"),
+    User.email.label("owner_email"),
+)
+
+
+class DetailProjection(NamedTuple):
+    """The part of Note.detail a read selects, so big bodies stay in the DB.
+
+    By default the whole detail is loaded. Rows loaded for a range hold only
+    that range of characters, starting at NoteRow.detail_offset.
+    """
+
+    offset: int = 0
+    length: Optional[int] = None
+    selected: bool = True
+    with_preview: bool = False
+
+
+FULL_DETAIL = DetailProjection()
+
+
+def _note_columns(projection: DetailProjection):
+    if not projection.selected:
+        detail = null()
+    elif projection.offset == 0 and projection.length is None:
+        detail = Note.detail
+    elif projection.length is None:
+        detail = func.substr(Note.detail, projection.offset + 1)
+    else:
+        detail = func.substr(Note.detail, projection.offset + 1, projection.length)
+
+    columns = [
+        detail.label("detail") if column is Note.__table__.c.detail else column
+        for column in Note.__table__.c
+    ]
+    if projection.with_preview:
+        columns.append(func.left(Note.detail, PREVIEW_LENGTH).label("preview"))
+    return columns
+
+
+def _note_from_row(row, owner=None, projection: DetailProjection = FULL_DETAIL):
+    if owner is None:
+        owner = UserRow(row.owner_id, row.owner_username, row.owner_email)
+    return NoteRow(
+        row.id,
+        row.title,
+        row.detail,
+        row.created_at,
+        row.updated_at,
+        row.owner_id,
+        owner,
+        detail_offset=projection.offset,
+        detail_length=row.detail_length,
+        preview=row.preview if projection.with_preview else None,
+        sync_version=row.sync_version,
     )
 
-    # Calculate total pages
-    total_pages = (total_notes // limit) + 1
 
-    notes = (
-        db.query(Note)
-        .filter(
-            Note.owner_id == current_user.id,
-            or_(
-                Note.title.ilike(f"%{q}%"),
-                Note.detail.ilike(f"%{q}%"),
+def _select_notes(projection: DetailProjection = FULL_DETAIL):
+    return select(*_note_columns(projection), *OWNER_COLUMNS).join(
+        User, User.id == Note.owner_id
+    )
+
+
+def _shared_with(user_id: int):
+    """Notes shared with the user directly or through one of their groups.
+
+    One row per note, with the strongest permission ("edit" sorts first in
+    the permissions enum) and the latest sync_version and sync_xid of the
+    shares and memberships it is reached through.
+    """
+    direct = select(
+        SharedNotes.note_id,
+        SharedNotes.note_owner_id,
+        SharedNotes.permission,
+        SharedNotes.sync_version,
+        SharedNotes.sync_xid,
+    ).where(SharedNotes.user_id == user_id)
+    grouped = (
+        select(
+            GroupSharedNotes.note_id,
+            GroupSharedNotes.note_owner_id,
+            GroupSharedNotes.permission,
+            func.greatest(
+                GroupSharedNotes.sync_version,
+                GroupMember.sync_version,
+                type_=BigInteger,
             ),
+            func.greatest(
+                GroupSharedNotes.sync_xid, GroupMember.sync_xid, type_=BigInteger
+            ),
+        )
+        .join(GroupMember, GroupMember.group_id == GroupSharedNotes.group_id)
+        .where(
+            GroupMember.user_id == user_id,
+            GroupSharedNotes.note_owner_id != user_id,
+        )
+    )
+    shares = union_all(direct, grouped).subquery()
+    return (
+        select(
+            shares.c.note_id,
+            shares.c.note_owner_id,
+            func.min(shares.c.permission).label("permission"),
+            func.max(shares.c.sync_version).label("sync_version"),
+            func.max(shares.c.sync_xid).label("sync_xid"),
         )
-        .order_by(desc(Note.created_at))
-        .limit(limit)
-        .offset(skip)
-        .all()
+        .group_by(shares.c.note_id, shares.c.note_owner_id)
+        .subquery("shared_with")
     )
 
-    return {"notes": notes, "total_pages": total_pages}
 
+def _joins_shared(shared):
+    return and_(
+        shared.c.note_id == Note.id,
+        shared.c.note_owner_id == Note.owner_id,
+    )
 
-async def get_note(
-    current_user,
-    id: int,
-    db: Session = SessionLocal(),
+
+def _owned_by(user_id: int, note_id):
+    # Aliased so it never correlates to a note of the outer query
+    note = aliased(Note)
+    return exists().where(note.id == note_id, note.owner_id == user_id)
+
+
+def _load_notes(current_user: User, q: str, page: int, projection: DetailProjection):
+    limit = 10
+    skip = (page - 1) * limit
+
+    filters = [Note.owner_id == current_user.id]
+    total_capped = False
+    with SessionLocal() as db:
+        if q:
+            filters.append(
+                or_(
+                    Note.title.ilike(f"%{q}%"),
+                    Note.detail.ilike(f"%{q}%"),
+                )
+            )
+            # Searches only count up to the cap so a broad query stays cheap
+            matching = (
+                db.query(Note.id)
+                .filter(*filters)
+                .limit(SEARCH_COUNT_CAP + 1)
+                .subquery()
+            )
+            total_notes = db.query(func.count()).select_from(matching).scalar()
+            if total_notes > SEARCH_COUNT_CAP:
+                total_notes = SEARCH_COUNT_CAP
+                total_capped = True
+        else:
+            total_notes = get_note_counts(current_user, db=db)["owned_notes"]
+
+        # Calculate total pages
+        total_pages = (total_notes // limit) + 1
+
+        rows = db.execute(
+            _select_notes(projection)
+            .where(*filters)
+            .order_by(desc(Note.created_at))
+            .limit(limit)
+            .offset(skip)
+        )
+        notes = [_note_from_row(row, projection=projection) for row in rows]
+
+    return {
+        "notes": notes,
+        "total_pages": total_pages,
+        "total_notes": total_notes,
+        "total_capped": total_capped,
+    }
+
+
+async def get_notes(
+    current_user: User,
+    q: Optional[str] = "",
+    page: Optional[int] = 1,
+    projection: DetailProjection = FULL_DETAIL,
 ):
-    note = (
-        db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id).first()
+    # Searches can be slow, keep them off the event loop so the request can
+    # be cancelled while they run
+    response = await run_in_threadpool(
+        _load_notes, current_user, q, page, projection
     )
+    response["notes"] = [autosave_buffer.overlay(note) for note in response["notes"]]
+    return response
+
+
+def get_note_counts(
+    current_user: User,
+    db: Optional[Session] = None,
+):
+    with session_scope(db) as db:
+        counter = db.execute(
+            select(NoteCounter.owned_notes, NoteCounter.shared_notes).where(
+                NoteCounter.user_id == current_user.id
+            )
+        ).first()
+        if not counter:
+            return {"owned_notes": 0, "shared_notes": 0}
+        return {
+            "owned_notes": counter.owned_notes,
+            "shared_notes": counter.shared_notes,
+        }
+
 
-    if note:
-        participants = (
-            db.query(User, SharedNotes.permission)
+def _load_note(id: int, owner_id: int, projection: DetailProjection):
+    with SessionLocal() as db:
+        # Looked up by note, so the participants probe ix_shared_notes_note_id
+        # in every shared_notes partition; both queries share one round trip
+        notes, participants, groups = pipeline(
+            db,
+            _select_notes(projection).where(Note.id == id, Note.owner_id == owner_id),
+            select(User.id, User.username, User.email, SharedNotes.permission)
             .join(SharedNotes, SharedNotes.user_id == User.id)
-            .filter(SharedNotes.note_id == note.id)
-            .all()
+            .where(SharedNotes.note_id == id),
+            # Groups are listed as such, not expanded into their members
+            select(Group.id, Group.name, Group.owner_id, GroupSharedNotes.permission)
+            .join(GroupSharedNotes, GroupSharedNotes.group_id == Group.id)
+            .where(GroupSharedNotes.note_id == id),
         )
+    if not notes:
+        return None
 
-        participants_info = [
-            Participant(user=user, permission=permission)
-            for user, permission in participants
-        ]
-        return {"note": note, "participants": participants_info}
-
-    # If the note is not owned by the current user, check if it's shared
-    shared_note = (
-        db.query(Note)
-        .join(SharedNotes, SharedNotes.note_id == Note.id)
-        .filter(Note.id == id, SharedNotes.user_id == current_user.id)
-        .first()
-    )
-    note = shared_note
+    participants_info = [
+        ParticipantRow(UserRow(row.id, row.username, row.email), row.permission)
+        for row in participants
+    ]
+
+    return {
+        "note": _note_from_row(notes[0], projection=projection),
+        "participants": participants_info,
+        "groups": [
+            GroupShareRow(GroupRow(row.id, row.name, row.owner_id), row.permission)
+            for row in groups
+        ],
+    }
+
+
+async def get_note(
+    current_user,
+    id: int,
+    db: Optional[Session] = None,
+    projection: DetailProjection = FULL_DETAIL,
+):
+    response = None
+    with session_scope(db) as db:
+        access = get_access(db, id, current_user.id)
+    if access:
+        # Everyone allowed to see the note gets the same response, so
+        # concurrent readers of a popular note share one load
+        response = await read_flight.do(
+            ("get_note", id, projection),
+            run_in_threadpool,
+            _load_note,
+            id,
+            access[1],
+            projection,
+        )
 
-    if not shared_note:
+    if not response:
         raise Exception(
             f"Note with id {id} is not shared with or owned by the current user",
         )
-    participants = (
-        db.query(User, SharedNotes.permission)
-        .join(SharedNotes, SharedNotes.user_id == User.id)
-        .filter(SharedNotes.note_id == note.id)
-        .all()
+    return {**response, "note": autosave_buffer.overlay(response["note"])}
+
+
+def _owns_note(db: Session, current_user, id: int) -> bool:
+    return bool(
+        db.query(Note.id)
+        .filter(Note.id == id, Note.owner_id == current_user.id)
+        .first()
     )
 
-    participants_info = [
-        Participant(user=user, permission=permission)
-        for user, permission in participants
-    ]
 
-    return {"note": note, "participants": participants_info}
+def _shared_response(db: Session, current_user, changed, id: int, user_id: int):
+    """Runs the share-row write in `changed` and loads the response rows with it."""
+    row = db.execute(
+        select(
+            *Note.__table__.c,
+            User.id.label("user_id"),
+            User.username.label("user_username"),
+            User.email.label("user_email"),
+            changed.c.permission,
+            acl_notification(id, user_id).label("acl_notified"),
+        )
+        .select_from(changed)
+        .join(
+            Note,
+            and_(
+                Note.id == changed.c.note_id,
+                Note.owner_id == changed.c.note_owner_id,
+            ),
+        )
+        .join(User, User.id == changed.c.user_id)
+    ).first()
+    if not row:
+        return None
+    return {
+        "note": _note_from_row(row, owner=current_user),
+        "user": UserRow(row.user_id, row.user_username, row.user_email),
+        "permission": row.permission,
+    }
 
 
 async def create_note(
     current_user,
     title: str,
     detail: str,
-    db: Session = SessionLocal(),
+    db: Optional[Session] = None,
 ):
-    try:
-        new_note = Note(title=title, detail=detail, owner_id=current_user.id)
-        db.add(new_note)
-        db.commit()
-        db.refresh(new_note)
-    except Exception as e:
-        raise Exception(
-            str(e),
-        )
-    return new_note
+    with session_scope(db) as db:
+        try:
+            row = db.execute(
+                insert(Note)
+                .values(title=title, detail=detail, owner_id=current_user.id)
+                .returning(*Note.__table__.c)
+            ).first()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise Exception(
+                str(e),
+            )
+        return _note_from_row(row, owner=current_user)
 
 
-async def update_note(
-    current_user,
+def _update_note_row(
+    db: Session,
+    user_id: int,
     id: int,
+    owner_id: int,
     title: str,
     detail: str,
-    db: Session = SessionLocal(),
+    base_version: Optional[int] = None,
 ):
-    note_query = db.query(Note).filter(Note.id == id)
+    can_edit = or_(
+        Note.owner_id == user_id,
+        exists().where(
+            SharedNotes.note_id == id,
+            SharedNotes.user_id == user_id,
+            SharedNotes.permission == "edit",
+        ),
+        exists().where(
+            GroupSharedNotes.note_id == id,
+            GroupSharedNotes.permission == "edit",
+            GroupMember.group_id == GroupSharedNotes.group_id,
+            GroupMember.user_id == user_id,
+        ),
+    )
+    filters = [Note.id == id, Note.owner_id == owner_id, can_edit]
+    if base_version is not None:
+        filters.append(Note.sync_version == base_version)
+    updated = (
+        update(Note)
+        .where(*filters)
+        .values(title=title, detail=detail)
+        .returning(*Note.__table__.c)
+        .cte("updated")
+    )
+    return db.execute(
+        select(updated, *OWNER_COLUMNS).join(User, User.id == updated.c.owner_id)
+    ).first()
 
-    if not note_query.first():
+
+def _raise_cannot_edit(db: Session, id: int):
+    if not db.query(Note.id).filter(Note.id == id).first():
         raise Exception(
             f"Note with id {id} does not exist",
         )
+    raise Exception(
+        "You do not have permission to edit this note",
+    )
 
-    # Check if the current user has access to the note
-    if note_query.first().owner_id != current_user.id:
-        # Check if the note is shared with the current user
-        shared_note = (
-            db.query(SharedNotes)
-            .filter(SharedNotes.note_id == id, SharedNotes.user_id == current_user.id)
-            .first()
+
+def _write_autosave(user_id: int, note: NoteRow):
+    # Only overwrites the version the autosave started from, a newer write
+    # (e.g. an explicit save handled by another worker) wins over the buffer
+    with SessionLocal() as db:
+        row = _update_note_row(
+            db,
+            user_id,
+            note.id,
+            note.owner_id,
+            note.title,
+            note.detail,
+            base_version=note.sync_version,
         )
-        if not shared_note or shared_note.permission != "edit":
-            raise Exception(
-                "You do not have permission to edit this note",
+        db.commit()
+    if not row:
+        logger.warning(
+            "Dropped autosave of note %s by user %s, it was changed or unshared",
+            note.id,
+            user_id,
+        )
+        return None
+    return row.sync_version
+
+
+autosave_buffer = AutosaveBuffer(
+    delay=settings.autosave_delay_seconds, write=_write_autosave
+)
+
+
+async def update_note(
+    current_user,
+    id: int,
+    title: str,
+    detail: str,
+    autosave: Optional[bool] = False,
+    db: Optional[Session] = None,
+):
+    with session_scope(db) as db:
+        if autosave:
+            if get_permission(db, id, current_user.id) not in ("owner", "edit"):
+                _raise_cannot_edit(db, id)
+            pending = autosave_buffer.pending(id)
+            if pending:
+                note = pending.note
+            else:
+                note = (await get_note(current_user, id, db=db))["note"]
+            buffered = NoteRow(
+                note.id,
+                title,
+                detail,
+                note.created_at,
+                note.updated_at,
+                note.owner_id,
+                note.owner,
+                sync_version=note.sync_version,
             )
+            autosave_buffer.save(current_user.id, buffered)
+            return buffered
 
-    # Update the note
-    note_query.update({"title": title, "detail": detail}, synchronize_session=False)
-    db.commit()
+        access = get_access(db, id, current_user.id)
+        if not access or access[0] not in ("owner", "edit"):
+            _raise_cannot_edit(db, id)
+        # An explicit save supersedes whatever is buffered for the note
+        await autosave_buffer.discard(id)
+        row = _update_note_row(db, current_user.id, id, access[1], title, detail)
+        db.commit()
 
-    return note_query.first()
+        if not row:
+            _raise_cannot_edit(db, id)
+        return _note_from_row(row)
 
 
 async def delete_note(
     current_user,
     id: int,
-    db: Session = SessionLocal(),
+    db: Optional[Session] = None,
 ):
-    note_query = db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id)
-    note = note_query.first()
-    if not note:
-        raise Exception(
-            f"Note with id {id} Does not Exist",
+    with session_scope(db) as db:
+        deleted = (
+            delete(Note)
+            .where(Note.id == id, Note.owner_id == current_user.id)
+            .returning(Note.id)
+            .cte("deleted")
         )
-    note_query.delete(synchronize_session=False)
-    db.commit()
-    return
+        row = db.execute(select(acl_notification(id)).select_from(deleted)).first()
+        if not row:
+            db.rollback()
+            raise Exception(
+                f"Note with id {id} Does not Exist",
+            )
+        acl_cache.invalidate(id)
+        db.commit()
+        await autosave_buffer.discard(id)
+        return
 
 
 async def share_note(
@@ -177,132 +524,548 @@ async def share_note(
     user_id: int,
     permission: str,
     id: int,
-    db: Session = SessionLocal(),
+    db: Optional[Session] = None,
 ):
-    note = (
-        db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id).first()
-    )
-    if not note:
-        raise Exception(
-            f"Note with id {id} Does not Exist",
+    with session_scope(db) as db:
+        shared = (
+            insert(SharedNotes)
+            .from_select(
+                ["user_id", "note_id", "note_owner_id", "permission"],
+                select(
+                    literal(user_id),
+                    Note.id,
+                    Note.owner_id,
+                    cast(literal(permission), SharedNotes.permission.type),
+                ).where(Note.id == id, Note.owner_id == current_user.id),
+            )
+            .returning(
+                SharedNotes.note_id,
+                SharedNotes.note_owner_id,
+                SharedNotes.user_id,
+                SharedNotes.permission,
+            )
+            .cte("shared")
         )
-    other_user = db.query(User).filter(User.id == user_id).first()
-    if not other_user:
-        raise Exception(
-            f"User with id {id} Does not Exist",
+        try:
+            response = _shared_response(db, current_user, shared, id, user_id)
+        except IntegrityError as e:
+            db.rollback()
+            if "duplicate key" in str(e):
+                username = db.query(User.username).filter(User.id == user_id).scalar()
+                raise Exception(
+                    f"Already sharing note with id: {id} with {username}",
+                )
+            if "foreign key" in str(e):
+                raise Exception(
+                    f"User with id {user_id} Does not Exist",
+                )
+            raise Exception(
+                str(e),
+            )
+        if not response:
+            db.rollback()
+            raise Exception(
+                f"Note with id {id} Does not Exist",
+            )
+        acl_cache.invalidate(id, user_id)
+        db.commit()
+        return response
+
+
+async def unshare_note(
+    current_user,
+    id: int,
+    user_id: int,
+    db: Optional[Session] = None,
+):
+    with session_scope(db) as db:
+        deleted = (
+            delete(SharedNotes)
+            .where(
+                SharedNotes.note_id == id,
+                SharedNotes.user_id == user_id,
+                exists().where(Note.id == id, Note.owner_id == current_user.id),
+            )
+            .returning(SharedNotes.note_id)
+            .cte("deleted")
         )
-    try:
-        shared = SharedNotes(user_id=user_id, permission=permission, note_id=id)
-        db.add(shared)
+        row = db.execute(
+            select(acl_notification(id, user_id)).select_from(deleted)
+        ).first()
+        if not row:
+            db.rollback()
+            if not _owns_note(db, current_user, id):
+                raise Exception(
+                    f"Note with id {id} not found.",
+                )
+            raise Exception(
+                f"Note is not shared with user {user_id}.",
+            )
+        acl_cache.invalidate(id, user_id)
         db.commit()
-    except Exception as e:
-        db.rollback()
-        if "duplicate key" in str(e):
+
+        return  # 204 No Content for successful deletion
+
+
+async def update_permission(
+    current_user,
+    user_id: int,
+    permission: str,
+    id: int,
+    db: Optional[Session] = None,
+):
+    with session_scope(db) as db:
+        updated = (
+            update(SharedNotes)
+            .where(
+                SharedNotes.note_id == id,
+                SharedNotes.user_id == user_id,
+                exists().where(Note.id == id, Note.owner_id == current_user.id),
+            )
+            .values(permission=permission)
+            .returning(
+                SharedNotes.note_id,
+                SharedNotes.note_owner_id,
+                SharedNotes.user_id,
+                SharedNotes.permission,
+            )
+            .cte("updated")
+        )
+        response = _shared_response(db, current_user, updated, id, user_id)
+        if not response:
+            db.rollback()
+            if not _owns_note(db, current_user, id):
+                raise Exception(
+                    f"Note with id {id} Does not Exist",
+                )
             raise Exception(
-                f"Already sharing note with id: {id} with {other_user.username}",
+                f"Note is not shared with user {user_id}.",
             )
-        raise Exception(
-            str(e),
+        acl_cache.invalidate(id, user_id)
+        db.commit()
+        return response
+
+
+async def share_note_with_group(
+    current_user,
+    group_id: int,
+    permission: str,
+    id: int,
+    db: Optional[Session] = None,
+):
+    with session_scope(db) as db:
+        # Only groups the owner belongs to can be shared with
+        shared = (
+            insert(GroupSharedNotes)
+            .from_select(
+                ["group_id", "note_id", "note_owner_id", "permission"],
+                select(
+                    literal(group_id),
+                    Note.id,
+                    Note.owner_id,
+                    cast(literal(permission), GroupSharedNotes.permission.type),
+                ).where(
+                    Note.id == id,
+                    Note.owner_id == current_user.id,
+                    exists().where(
+                        GroupMember.group_id == group_id,
+                        GroupMember.user_id == current_user.id,
+                    ),
+                ),
+            )
+            .returning(
+                GroupSharedNotes.note_id,
+                GroupSharedNotes.note_owner_id,
+                GroupSharedNotes.group_id,
+                GroupSharedNotes.permission,
+            )
+            .cte("shared")
         )
-    return {"note": note, "user": other_user, "permission": permission}
+        try:
+            row = db.execute(
+                select(
+                    shared.c.permission,
+                    *Note.__table__.c,
+                    Group.name.label("group_name"),
+                    Group.owner_id.label("group_owner_id"),
+                    acl_notification(id).label("acl_notified"),
+                )
+                .select_from(shared)
+                .join(
+                    Note,
+                    and_(
+                        Note.id == shared.c.note_id,
+                        Note.owner_id == shared.c.note_owner_id,
+                    ),
+                )
+                .join(Group, Group.id == shared.c.group_id)
+            ).first()
+        except IntegrityError as e:
+            db.rollback()
+            if "duplicate key" in str(e):
+                raise Exception(
+                    f"Already sharing note with id: {id} with group {group_id}",
+                )
+            raise Exception(
+                str(e),
+            )
+        if not row:
+            db.rollback()
+            if not _owns_note(db, current_user, id):
+                raise Exception(
+                    f"Note with id {id} Does not Exist",
+                )
+            raise Exception(
+                f"You are not a member of group {group_id}.",
+            )
+        # A group may raise the permission members already have cached
+        acl_cache.invalidate(id)
+        db.commit()
+        return {
+            "note": _note_from_row(row, owner=current_user),
+            "group": GroupRow(group_id, row.group_name, row.group_owner_id),
+            "permission": row.permission,
+        }
 
 
-async def unshare_note(
+async def unshare_note_with_group(
     current_user,
     id: int,
-    user_id: int,
-    db: Session = SessionLocal(),
+    group_id: int,
+    db: Optional[Session] = None,
 ):
-    note = (
-        db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id).first()
-    )
-    if not note:
-        raise Exception(
-            f"Note with id {id} not found.",
+    with session_scope(db) as db:
+        deleted = (
+            delete(GroupSharedNotes)
+            .where(
+                GroupSharedNotes.note_id == id,
+                GroupSharedNotes.group_id == group_id,
+                exists().where(Note.id == id, Note.owner_id == current_user.id),
+            )
+            .returning(GroupSharedNotes.note_id)
+            .cte("deleted")
         )
-    if note.owner_id != current_user.id:
-        raise Exception(
-            "you are not the owner of this note",
+        row = db.execute(select(acl_notification(id)).select_from(deleted)).first()
+        if not row:
+            db.rollback()
+            if not _owns_note(db, current_user, id):
+                raise Exception(
+                    f"Note with id {id} not found.",
+                )
+            raise Exception(
+                f"Note is not shared with group {group_id}.",
+            )
+        acl_cache.invalidate(id)
+        db.commit()
+
+        return
+
+
+def _load_shared_notes(
+    user_id: int, limit: int, skip: int, projection: DetailProjection
+):
+    shared = _shared_with(user_id)
+    with SessionLocal() as db:
+        rows = db.execute(
+            _select_notes(projection)
+            .join(shared, _joins_shared(shared))
+            .order_by(desc(Note.created_at))
+            .limit(limit)
+            .offset(skip)
         )
-    # Delete the shared note entry
-    shared_note = (
-        db.query(SharedNotes)
-        .filter(SharedNotes.note_id == id, SharedNotes.user_id == user_id)
-        .first()
+        return [_note_from_row(row, projection=projection) for row in rows]
+
+
+async def list_shared_notes(
+    current_user,
+    limit: Optional[int] = 10,
+    skip: Optional[int] = 0,
+    projection: DetailProjection = FULL_DETAIL,
+):
+    notes = await read_flight.do(
+        ("list_shared_notes", current_user.id, limit, skip, projection),
+        run_in_threadpool,
+        _load_shared_notes,
+        current_user.id,
+        limit,
+        skip,
+        projection,
     )
-    if not shared_note:
+    return [autosave_buffer.overlay(note) for note in notes]
+
+
+def _encode_cursor(note: NoteRow) -> str:
+    value = f"{note.created_at.isoformat()}|{note.id}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except ValueError:
         raise Exception(
-            f"Note is not shared with user {user_id}.",
+            "Invalid cursor",
         )
-    try:
-        db.delete(shared_note)
-        db.commit()
 
-    except IntegrityError as e:
-        raise Exception(
-            f"Error unsharing note: {str(e)}",
+
+def _load_feed(
+    user_id: int,
+    first: int,
+    after: Optional[str],
+    q: str,
+    projection: DetailProjection,
+):
+    filters = []
+    if after:
+        created_at, id = _decode_cursor(after)
+        filters.append(tuple_(Note.created_at, Note.id) < tuple_(created_at, id))
+    if q:
+        filters.append(
+            or_(
+                Note.title.ilike(f"%{q}%"),
+                Note.detail.ilike(f"%{q}%"),
+            )
         )
+    newest_first = (desc(Note.created_at), desc(Note.id))
 
-    return  # 204 No Content for successful deletion
+    # Both branches are cut at one page before they are merged. The owned
+    # branch stops reading there; the shared one still aggregates every note
+    # shared with the user in _shared_with first, so it grows with that count
+    owned = (
+        _select_notes(projection)
+        .add_columns(literal("owner", String).label("permission"))
+        .where(Note.owner_id == user_id, *filters)
+        .order_by(*newest_first)
+        .limit(first + 1)
+    )
+    shared_with = _shared_with(user_id)
+    shared = (
+        _select_notes(projection)
+        .add_columns(cast(shared_with.c.permission, String).label("permission"))
+        .join(shared_with, _joins_shared(shared_with))
+        .where(Note.owner_id != user_id, *filters)
+        .order_by(*newest_first)
+        .limit(first + 1)
+    )
+    feed = union_all(owned, shared).subquery()
 
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(feed)
+            .order_by(desc(feed.c.created_at), desc(feed.c.id))
+            .limit(first + 1)
+        ).all()
+    return [
+        FeedItemRow(_note_from_row(row, projection=projection), row.permission)
+        for row in rows
+    ]
 
-async def update_permission(
+
+async def get_feed(
     current_user,
-    user_id: int,
-    permission: str,
-    id: int,
-    db: Session = SessionLocal(),
+    first: int = 10,
+    after: Optional[str] = None,
+    q: Optional[str] = "",
+    projection: DetailProjection = FULL_DETAIL,
 ):
-    note = (
-        db.query(Note).filter(Note.id == id, Note.owner_id == current_user.id).first()
+    first = max(1, min(first, FEED_MAX_PAGE_SIZE))
+    items = await run_in_threadpool(
+        _load_feed, current_user.id, first, after, q, projection
     )
-    if not note:
+
+    has_next_page = len(items) > first
+    items = items[:first]
+    for item in items:
+        item.note = autosave_buffer.overlay(item.note)
+    return {
+        "items": items,
+        "end_cursor": _encode_cursor(items[-1].note) if items else None,
+        "has_next_page": has_next_page,
+    }
+
+
+def _encode_sync_cursor(position: Tuple[int, int, int]) -> str:
+    value = "x" + ".".join(str(part) for part in position)
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def _decode_sync_cursor(cursor: str) -> Tuple[int, int, int]:
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        if not value.startswith("x"):
+            raise ValueError(value)
+        xid, version, note_id = value[1:].split(".")
+        return int(xid), int(version), int(note_id)
+    except ValueError:
         raise Exception(
-            f"Note with id {id} Does not Exist",
+            "Invalid cursor",
         )
-    if note.owner_id != current_user.id:
-        raise Exception(
-            "you are not the owner of this note",
+
+
+def _after(key, position: Tuple[int, int, int]):
+    # Bound as BIGINT, transaction ids and versions outgrow an INTEGER
+    return tuple_(*key) > tuple_(*(literal(part, BigInteger) for part in position))
+
+
+def _tombstone_stream(
+    user_id: int,
+    position: Tuple[int, int, int],
+    limit: int,
+    projection: DetailProjection,
+    tombstone,
+):
+    """Tombstones after `position`, with the note if the user can still reach it.
+
+    A share that goes away while another one remains changes the user's
+    permission, so such a tombstone is reported as a change of the note at
+    its own position. Tombstones of notes the user owns are skipped. Like
+    the shared stream, this reads every note shared with the user.
+    """
+    key = (tombstone.sync_xid, tombstone.sync_version, tombstone.note_id)
+    shared_with = _shared_with(user_id)
+    return (
+        select(
+            tombstone.sync_xid.label("xid"),
+            tombstone.sync_version.label("version"),
+            tombstone.note_id.label("removed_id"),
+            *_note_columns(projection),
+            *OWNER_COLUMNS,
+            cast(shared_with.c.permission, String).label("permission"),
         )
-    other_user = db.query(User).filter(User.id == user_id).first()
-    if not other_user:
-        raise Exception(
-            f"User with id {id} Does not Exist",
+        .select_from(tombstone)
+        .outerjoin(shared_with, shared_with.c.note_id == tombstone.note_id)
+        .outerjoin(Note, _joins_shared(shared_with))
+        .outerjoin(User, User.id == Note.owner_id)
+        .where(_after(key, position), ~_owned_by(user_id, tombstone.note_id))
+        .order_by(*key)
+        .limit(limit + 1)
+    )
+
+
+def _load_changes(
+    user_id: int,
+    position: Tuple[int, int, int],
+    limit: int,
+    projection: DetailProjection,
+):
+    # Transactions below the oldest one still running have all finished, so
+    # nothing can show up below the horizon once a client has read past it
+    horizon = select(
+        cast(
+            cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), Text),
+            BigInteger,
+        ).label("horizon")
+    )
+    owned_key = (Note.sync_xid, Note.sync_version, Note.id)
+    owned = (
+        _select_notes(projection)
+        .add_columns(
+            literal("owner", String).label("permission"),
+            Note.sync_xid.label("xid"),
+            Note.sync_version.label("version"),
         )
-    shared_note = (
-        db.query(SharedNotes)
-        .filter(SharedNotes.note_id == id, SharedNotes.user_id == user_id)
-        .first()
+        .where(Note.owner_id == user_id, _after(owned_key, position))
+        .order_by(*owned_key)
+        .limit(limit + 1)
     )
-    if not shared_note:
-        raise Exception(
-            f"Note is not shared with user {user_id}.",
+    # A shared note changes when the note, the share or the membership it is
+    # shared through does. Its position is computed from all of them, so
+    # unlike the other streams this one reads every note shared with the
+    # user on each call and grows with that count
+    shared_with = _shared_with(user_id)
+    shared_xid = func.greatest(shared_with.c.sync_xid, Note.sync_xid, type_=BigInteger)
+    shared_version = func.greatest(
+        shared_with.c.sync_version, Note.sync_version, type_=BigInteger
+    )
+    shared_key = (shared_xid, shared_version, Note.id)
+    shared = (
+        _select_notes(projection)
+        .add_columns(
+            cast(shared_with.c.permission, String).label("permission"),
+            shared_xid.label("xid"),
+            shared_version.label("version"),
         )
+        .join(shared_with, _joins_shared(shared_with))
+        .where(Note.owner_id != user_id, _after(shared_key, position))
+        .order_by(*shared_key)
+        .limit(limit + 1)
+    )
+    removed = _tombstone_stream(
+        user_id, position, limit, projection, NoteTombstone
+    ).where(NoteTombstone.user_id == user_id)
+    group_removed = (
+        _tombstone_stream(user_id, position, limit, projection, GroupNoteTombstone)
+        .join(GroupMember, GroupMember.group_id == GroupNoteTombstone.group_id)
+        .where(GroupMember.user_id == user_id)
+    )
 
-    try:
-        shared_note.permission = permission
-        db.add(shared_note)
-        db.commit()
-    except IntegrityError as e:
-        raise Exception(
-            f"Error updating permission: {str(e)}",
+    with SessionLocal() as db:
+        # The horizon is read first, so every later statement sees at least
+        # the transactions it says have finished
+        horizon, owned, shared, removed, group_removed = pipeline(
+            db, horizon, owned, shared, removed, group_removed
         )
-    return {"note": note, "user": other_user, "permission": permission}
+    horizon = horizon[0].horizon
 
+    events = [
+        (
+            (row.xid, row.version, row.id),
+            row.id,
+            FeedItemRow(_note_from_row(row, projection=projection), row.permission),
+        )
+        for row in owned + shared
+    ]
+    for row in removed + group_removed:
+        item = None
+        if row.id is not None:
+            item = FeedItemRow(
+                _note_from_row(row, projection=projection), row.permission
+            )
+        events.append(((row.xid, row.version, row.removed_id), row.removed_id, item))
+    # Every stream is ordered by transaction id first, so this only cuts off
+    # their tails; those rows are returned once everything before them is
+    events = [event for event in events if event[0][0] < horizon]
+    events.sort(key=lambda event: event[0])
+    return events
 
-async def list_shared_notes(
+
+async def changes_since(
     current_user,
-    db: Session = SessionLocal(),
-    limit: Optional[int] = 10,
-    skip: Optional[int] = 0,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    projection: DetailProjection = FULL_DETAIL,
 ):
-    shared_notes = (
-        db.query(Note)
-        .join(SharedNotes, SharedNotes.note_id == Note.id)
-        .filter(SharedNotes.user_id == current_user.id)
-        .order_by(desc(Note.created_at))
-        .limit(limit)
-        .offset(skip)
-        .all()
+    """Returns what changed for the user after the state `cursor` describes.
+
+    Every note write, share change and tombstone takes a fresh value of
+    sync_version_seq and records its transaction id. Changes are ordered by
+    (transaction id, version, note id) and only returned once every
+    transaction that could still commit one before them has finished, so a
+    cursor is simply the position of the last change a client has applied;
+    without one the whole library is returned, page by page.
+    """
+    limit = max(1, min(limit, SYNC_MAX_PAGE_SIZE))
+    position = _decode_sync_cursor(cursor) if cursor else (0, 0, 0)
+    events = await run_in_threadpool(
+        _load_changes, current_user.id, position, limit, projection
     )
-    return shared_notes
+
+    has_more = len(events) > limit
+    events = events[:limit]
+    # Only the latest event of a note in this page matters to the client
+    latest = {}
+    for _, note_id, item in events:
+        latest.pop(note_id, None)
+        latest[note_id] = item
+    changed = []
+    for item in latest.values():
+        if item is not None:
+            item.note = autosave_buffer.overlay(item.note)
+            changed.append(item)
+    return {
+        "changed": changed,
+        "removed": [note_id for note_id, item in latest.items() if item is None],
+        "cursor": _encode_sync_cursor(events[-1][0] if events else position),
+        "has_more": has_more,
+    }
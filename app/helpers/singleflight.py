@@ -0,0 +1,141 @@
+import asyncio
+import contextvars
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from app.config import settings
+from app.database import inflight_connections, statement_timeout
+
+
+class _Call:
+    """One shared call and the requests waiting on it.
+
+    Its statements run under the largest statement timeout of the waiters
+    and register in a connection set of their own, which is cancelled once
+    every waiter has left before the call finished.
+    """
+
+    __slots__ = (
+        "future",
+        "timeout",
+        "waiters",
+        "connections",
+        "finished",
+        "abandoned",
+        "_lock",
+    )
+
+    def __init__(self, timeout: int) -> None:
+        self.future = None
+        self.timeout = timeout
+        self.waiters = 0
+        self.connections = set()
+        self.finished = False
+        # Set once the last waiter left early, later callers start over
+        self.abandoned = False
+        self._lock = threading.Lock()
+
+    def join(self, timeout: int) -> "_Waiter":
+        with self._lock:
+            self.waiters += 1
+            # Only statements issued from now on see the larger timeout
+            self.timeout = max(self.timeout, timeout)
+        return _Waiter(self)
+
+    def leave(self, waiter: "_Waiter") -> bool:
+        """Returns whether the call was abandoned by its last waiter."""
+        with self._lock:
+            if waiter.left:
+                return False
+            waiter.left = True
+            self.waiters -= 1
+            if self.waiters == 0 and not self.finished:
+                self.abandoned = True
+            return self.abandoned
+
+    def cancel_queries(self):
+        # connection.cancel() waits for the server, call it off the loop
+        for connection in list(self.connections):
+            connection.cancel()
+
+    def current_timeout(self) -> int:
+        return self.timeout
+
+
+class _Waiter:
+    """A request waiting on a _Call, kept in the request's inflight set.
+
+    QueryCancellationMiddleware cancels it like a connection when the
+    client goes away, which only cancels the call's queries if nobody else
+    is waiting on them.
+    """
+
+    __slots__ = ("call", "left")
+
+    def __init__(self, call: _Call) -> None:
+        self.call = call
+        self.left = False
+
+    def cancel(self):
+        if self.call.leave(self):
+            self.call.cancel_queries()
+
+
+def _request_timeout() -> int:
+    timeout = statement_timeout.get()
+    return settings.statement_timeout_ms if timeout is None else timeout
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls into one in-flight awaitable.
+
+    Nothing is kept once the call finishes, callers arriving afterwards start
+    a new one, so this only absorbs bursts and never serves stale results.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, _Call] = {}
+
+    async def do(
+        self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        timeout = _request_timeout()
+        call = self._calls.get(key)
+        if call is None or call.abandoned:
+            call = self._start(key, timeout, fn, *args, **kwargs)
+        waiter = call.join(timeout)
+        connections = inflight_connections.get()
+        if connections is not None:
+            connections.add(waiter)
+        try:
+            # A cancelled caller must not cancel the call the others are
+            # waiting on, leaving below only does if it was the last one
+            return await asyncio.shield(call.future)
+        finally:
+            if connections is not None:
+                connections.discard(waiter)
+            if call.leave(waiter):
+                asyncio.get_running_loop().run_in_executor(None, call.cancel_queries)
+
+    def _start(self, key, timeout: int, fn, *args, **kwargs) -> _Call:
+        call = _Call(timeout)
+        # The call's statements are tracked and timed by the call itself,
+        # not by the request that happened to start it
+        context = contextvars.copy_context()
+        context.run(inflight_connections.set, call.connections)
+        context.run(statement_timeout.set, call.current_timeout)
+        call.future = context.run(asyncio.ensure_future, fn(*args, **kwargs))
+        self._calls[key] = call
+        call.future.add_done_callback(lambda _: self._finish(key, call))
+        return call
+
+    def _finish(self, key: Hashable, call: _Call):
+        call.finished = True
+        self._forget(key, call)
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+read_flight = SingleFlight()
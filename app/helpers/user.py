@@ -0,0 +1,137 @@
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select, union_all
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import User
+from app.types.rows import UserRow
+
+# Hard cap on what searchUsers loads and returns
+USER_SEARCH_MAX_RESULTS = 20
+
+# Surrogates cannot be stored, the code point after U+D7FF is U+E000
+SURROGATES = range(0xD800, 0xE000)
+
+# A matching user with its username and email as lowered by Postgres
+Match = Tuple[UserRow, Tuple[str, str]]
+
+
+class PrefixCache:
+    """Per-worker LRU of recent user searches, each kept for `ttl` seconds.
+
+    A result list shorter than the cap holds every match of its prefix, so
+    it also answers any longer prefix typed after it. Those are filtered on
+    the values Postgres lowered, as the query would.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, prefix: str) -> Optional[List[Match]]:
+        now = time.monotonic()
+        for length in range(len(prefix), 0, -1):
+            entry = self._entries.get(prefix[:length])
+            if entry is None:
+                continue
+            expires, users = entry
+            if expires < now:
+                del self._entries[prefix[:length]]
+                continue
+            if length == len(prefix):
+                self._entries.move_to_end(prefix)
+                return users
+            if len(users) < USER_SEARCH_MAX_RESULTS:
+                return [
+                    (user, keys)
+                    for user, keys in users
+                    if any(key.startswith(prefix) for key in keys)
+                ]
+        return None
+
+    def set(self, prefix: str, users: List[Match]):
+        self._entries[prefix] = (time.monotonic() + self.ttl, users)
+        self._entries.move_to_end(prefix)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+user_search_cache = PrefixCache(
+    maxsize=settings.user_search_cache_size, ttl=settings.user_search_cache_ttl
+)
+
+
+def _prefix_end(prefix: str) -> Optional[str]:
+    """The smallest string after every string starting with `prefix`.
+
+    None when there is none, i.e. the prefix is only U+10FFFF characters.
+    """
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10FFFF:
+            last += 1
+            if last in SURROGATES:
+                last = SURROGATES.stop
+            return prefix[:-1] + chr(last)
+        prefix = prefix[:-1]
+    return None
+
+
+def _load_users(prefix: str) -> List[Match]:
+    # In byte order the matches of a prefix are one range, which stays an
+    # index range even in generic plans of the prepared statement. Each
+    # branch is read from its lower(...) COLLATE "C" index in order and stops
+    # after the cap however common the prefix is.
+    end = _prefix_end(prefix)
+    username_key = func.lower(User.username).collate("C")
+    email_key = func.lower(User.email).collate("C")
+    branches = []
+    for key in (username_key, email_key):
+        in_range = [key >= prefix]
+        if end is not None:
+            in_range.append(key < end)
+        branches.append(
+            select(
+                User.id,
+                User.username,
+                User.email,
+                username_key.label("username_key"),
+                email_key.label("email_key"),
+                key.label("match"),
+            )
+            .where(*in_range)
+            .order_by(key)
+            .limit(USER_SEARCH_MAX_RESULTS)
+        )
+
+    with SessionLocal() as db:
+        rows = db.execute(union_all(*branches)).all()
+    users = {}
+    for row in sorted(rows, key=lambda row: row.match):
+        users.setdefault(
+            row.id,
+            (
+                UserRow(row.id, row.username, row.email),
+                (row.username_key, row.email_key),
+            ),
+        )
+    return list(users.values())[:USER_SEARCH_MAX_RESULTS]
+
+
+async def search_users(current_user, prefix: str, first: int = 10):
+    first = max(1, min(first, USER_SEARCH_MAX_RESULTS))
+    prefix = prefix.strip().lower()
+    if not prefix:
+        return []
+
+    users = user_search_cache.get(prefix)
+    if users is None:
+        users = await run_in_threadpool(_load_users, prefix)
+        user_search_cache.set(prefix, users)
+    # The cache is shared by everyone, so the caller is only dropped here
+    return [user for user, _ in users if user.id != current_user.id][:first]
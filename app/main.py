@@ -1,11 +1,18 @@
 from fastapi import FastAPI, Request, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware, DispatchFunction
 from starlette.types import ASGIApp
 
+from app.config import settings
 from app.routers import auth, note
-from app.utils import TokenBucket
+from app.middleware.compression import CompressionMiddleware
+from app.middleware.cancellation import QueryCancellationMiddleware
+from app.middleware.concurrency import ConcurrencyLimitMiddleware
+from app.helpers.acl import acl_listener
+from app.helpers.loop_monitor import LoopLagMonitor
+from app.helpers.note import autosave_buffer
+from app.utils import TokenBucket, AdaptiveConcurrencyLimiter
 
 
 app = FastAPI()
@@ -35,6 +42,17 @@ bucket = TokenBucket(capacity=50, refill_rate=5)
 
 # app.add_middleware(RateLimitMiddleware, bucket=bucket)
 
+limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=settings.concurrency_initial_limit,
+    min_limit=settings.concurrency_min_limit,
+    max_limit=settings.concurrency_max_limit,
+)
+
+loop_monitor = LoopLagMonitor(
+    interval=settings.loop_lag_interval_seconds,
+    block_threshold=settings.loop_block_threshold_seconds,
+)
+
 
 app.include_router(auth.router)
 app.include_router(note.graphql_app, prefix="/graphql/notes")
@@ -44,6 +62,13 @@ origins = [
     "https://mind-castle-gql.vercel.app",
 ]
 
+app.add_middleware(QueryCancellationMiddleware)
+
+app.add_middleware(ConcurrencyLimitMiddleware, limiter=limiter)
+
+app.add_middleware(
+    CompressionMiddleware, minimum_size=settings.compression_minimum_size
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -54,6 +79,36 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def start_acl_listener():
+    acl_listener.start()
+
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+
+
+@app.on_event("shutdown")
+def stop_acl_listener():
+    acl_listener.stop()
+
+
+@app.on_event("shutdown")
+async def flush_autosaves():
+    await autosave_buffer.flush_all()
+
+
+@app.on_event("shutdown")
+def stop_loop_monitor():
+    loop_monitor.stop()
+
+
 @app.get("/")
 def home():
     return {"message": "Hello World!"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return loop_monitor.render()
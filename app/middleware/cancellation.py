@@ -0,0 +1,56 @@
+import asyncio
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.database import inflight_connections
+
+
+class QueryCancellationMiddleware:
+    """Cancels a request's running queries as soon as its client disconnects.
+
+    Once the request body has been read, the client's receive channel is only
+    watched for http.disconnect; the app sees that disconnect too if it asks.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        connections = set()
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+
+        async def receive_request() -> Message:
+            if body_read.is_set():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+                body_read.set()
+            elif not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def watch_disconnect():
+            await body_read.wait()
+            while not disconnected.is_set():
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+            # cancel() waits for the server's reply, keep it off the loop
+            for connection in list(connections):
+                await run_in_threadpool(connection.cancel)
+
+        token = inflight_connections.set(connections)
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await self.app(scope, receive_request, send)
+        finally:
+            watcher.cancel()
+            inflight_connections.reset(token)
@@ -0,0 +1,95 @@
+import json
+import re
+import time
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils import AdaptiveConcurrencyLimiter
+
+MUTATION_PATTERN = re.compile(r"^\s*mutation\b")
+SEARCH_PATTERN = re.compile(r"\bq\s*:")
+
+# Health checks and metrics scrapes bypass the limiter, they have to answer
+# most when the server is overloaded and would skew its latency samples
+EXEMPT_PATHS = frozenset(("/", "/metrics"))
+
+
+def classify(scope: Scope, body: bytes) -> str:
+    """Mutations are critical, anonymous traffic and searches are low."""
+    is_graphql = scope["path"].startswith("/graphql")
+    if not is_graphql and scope["method"] not in ("GET", "HEAD", "OPTIONS"):
+        return "critical"
+    if "authorization" not in Headers(scope=scope):
+        return "low"
+    try:
+        payload = json.loads(body) if body else {}
+    except ValueError:
+        return "normal"
+    if not isinstance(payload, dict):
+        return "normal"
+    # Malformed requests are left for GraphQL to reject
+    query = payload.get("query") or ""
+    variables = payload.get("variables") or {}
+    if not isinstance(query, str) or not isinstance(variables, dict):
+        return "normal"
+    if MUTATION_PATTERN.match(query):
+        return "critical"
+    if SEARCH_PATTERN.search(query) or variables.get("q"):
+        return "low"
+    return "normal"
+
+
+class ConcurrencyLimitMiddleware:
+    """Sheds requests over the adaptive limit with 503 and Retry-After."""
+
+    def __init__(self, app: ASGIApp, limiter: AdaptiveConcurrencyLimiter) -> None:
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        # GraphQL bodies are small, read them up front to classify and
+        # replay them to the app
+        messages = []
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        if not self.limiter.try_acquire(classify(scope, body)):
+            response = JSONResponse(
+                content={"detail": "Server overloaded"},
+                status_code=503,
+                headers={"Retry-After": str(self.limiter.retry_after())},
+            )
+            await response(scope, receive, send)
+            return
+
+        async def replay() -> Message:
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        status = 500
+
+        async def send_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, replay, send_status)
+        finally:
+            self.limiter.release(time.monotonic() - start, dropped=status >= 500)
@@ -1,10 +1,27 @@
 from .database import Base
-from sqlalchemy import Text, Enum, Column, ForeignKey, Integer, String, Index
+from sqlalchemy import (
+    BigInteger,
+    Text,
+    Enum,
+    Column,
+    ForeignKey,
+    Integer,
+    Sequence,
+    String,
+    Index,
+)
 from sqlalchemy.types import ARRAY
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql.expression import text
+from sqlalchemy.sql.expression import func, text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.schema import UniqueConstraint, ForeignKeyConstraint
+
+
+# Every change visible to delta sync takes the next value of this sequence
+# and records the id of its transaction in sync_xid, see changes_since() in
+# app/helpers/note.py
+sync_version_seq = Sequence("sync_version_seq", metadata=Base.metadata)
+CURRENT_XID = "pg_current_xact_id()::text::bigint"
 
 
 class User(Base):
@@ -15,21 +32,48 @@ class User(Base):
     password = Column(String, nullable=False)
     notes = relationship("Note", back_populates="owner")
 
+    # Byte-ordered, so prefix searches are index ranges returned in order
+    __table_args__ = (
+        Index("ix_users_lower_username", func.lower(username).collate("C")),
+        Index("ix_users_lower_email", func.lower(email).collate("C")),
+    )
+
 
+# notes and shared_notes are hash partitioned by the user they belong to,
+# queries should always filter on that column so Postgres can prune
 class Note(Base):
     __tablename__ = "notes"
-    id = Column(Integer, primary_key=True, nullable=False)
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     title = Column(String, nullable=False, index=True)
+    # STORAGE EXTERNAL (see migration a2f7c9e4b318), so ranged reads with
+    # substr() only fetch the chunks they need
     detail = Column(Text, nullable=False)
+    # Set by the notes_detail_length trigger whenever detail is written, so
+    # detailLength never has to read the body
+    detail_length = Column(Integer, nullable=False)
     created_at = Column(
         TIMESTAMP(timezone=True),
         nullable=False,
         server_default=text("now()"),
         index=True,
     )
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # All three are bumped by the notes_touch trigger on every update
+    updated_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+    sync_version = Column(
+        BigInteger, nullable=False, server_default=sync_version_seq.next_value()
+    )
+    sync_xid = Column(BigInteger, nullable=False, server_default=text(CURRENT_XID))
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True, nullable=False)
     owner = relationship("User", back_populates="notes")
 
+    __table_args__ = (
+        Index("ix_notes_owner_id_created_at", "owner_id", "created_at", "id"),
+        Index("ix_notes_owner_id_sync_xid", "owner_id", "sync_xid", "sync_version"),
+        {"postgresql_partition_by": "HASH (owner_id)"},
+    )
+
 
 class SharedNotes(Base):
     __tablename__ = "shared_notes"
@@ -39,24 +83,177 @@ class SharedNotes(Base):
         primary_key=True,
         nullable=False,
     )
-    note_id = Column(
-        Integer,
-        ForeignKey(
-            "notes.id",
+    note_id = Column(Integer, primary_key=True, nullable=False, index=True)
+    note_owner_id = Column(Integer, nullable=False)
+    permission = Column(
+        Enum("edit", "read_only", name="permissions"),
+        nullable=False,
+        default="read_only",
+        index=True,
+    )
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+        index=True,
+    )
+    sync_version = Column(
+        BigInteger, nullable=False, server_default=sync_version_seq.next_value()
+    )
+    sync_xid = Column(BigInteger, nullable=False, server_default=text(CURRENT_XID))
+
+    __table_args__ = (
+        Index(
+            "ix_shared_notes_user_id_sync_xid", "user_id", "sync_xid", "sync_version"
+        ),
+        ForeignKeyConstraint(
+            ["note_id", "note_owner_id"],
+            ["notes.id", "notes.owner_id"],
             ondelete="CASCADE",
         ),
+        {"postgresql_partition_by": "HASH (user_id)"},
+    )
+
+
+class NoteCounter(Base):
+    __tablename__ = "note_counters"
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    )
+    owned_notes = Column(Integer, nullable=False, server_default=text("0"))
+    # Direct shares only, group shares are not counted
+    shared_notes = Column(Integer, nullable=False, server_default=text("0"))
+
+
+# Left behind by triggers when a note is deleted or unshared, so delta sync
+# can tell each affected user to drop it
+class NoteTombstone(Base):
+    __tablename__ = "note_tombstones"
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    )
+    sync_version = Column(
+        BigInteger,
         primary_key=True,
         nullable=False,
+        server_default=sync_version_seq.next_value(),
     )
+    sync_xid = Column(BigInteger, nullable=False, server_default=text(CURRENT_XID))
+    note_id = Column(Integer, nullable=False)
+    deleted_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_note_tombstones_user_id_sync_xid", "user_id", "sync_xid", "sync_version"
+        ),
+    )
+
+
+class Group(Base):
+    __tablename__ = "groups"
+    id = Column(Integer, primary_key=True, nullable=False)
+    name = Column(String, nullable=False)
+    owner_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    created_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+
+
+# Keyed by user first, access checks join a user's memberships
+class GroupMember(Base):
+    __tablename__ = "group_members"
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    )
+    group_id = Column(
+        Integer,
+        ForeignKey("groups.id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+        index=True,
+    )
+    sync_version = Column(
+        BigInteger, nullable=False, server_default=sync_version_seq.next_value()
+    )
+    sync_xid = Column(BigInteger, nullable=False, server_default=text(CURRENT_XID))
+    created_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+
+
+# One row per note and group however many members the group has
+class GroupSharedNotes(Base):
+    __tablename__ = "group_shared_notes"
+    group_id = Column(
+        Integer,
+        ForeignKey("groups.id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    )
+    note_id = Column(Integer, primary_key=True, nullable=False, index=True)
+    note_owner_id = Column(Integer, nullable=False)
     permission = Column(
         Enum("edit", "read_only", name="permissions"),
         nullable=False,
         default="read_only",
-        index=True,
     )
+    sync_version = Column(
+        BigInteger, nullable=False, server_default=sync_version_seq.next_value()
+    )
+    sync_xid = Column(BigInteger, nullable=False, server_default=text(CURRENT_XID))
     created_at = Column(
-        TIMESTAMP(timezone=True),
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["note_id", "note_owner_id"],
+            ["notes.id", "notes.owner_id"],
+            ondelete="CASCADE",
+        ),
+    )
+
+
+# Left behind when a note is unshared from a group, read through the
+# members' group_members rows
+class GroupNoteTombstone(Base):
+    __tablename__ = "group_note_tombstones"
+    group_id = Column(
+        Integer,
+        ForeignKey("groups.id", ondelete="CASCADE"),
+        primary_key=True,
         nullable=False,
-        server_default=text("now()"),
-        index=True,
+    )
+    sync_version = Column(
+        BigInteger,
+        primary_key=True,
+        nullable=False,
+        server_default=sync_version_seq.next_value(),
+    )
+    sync_xid = Column(BigInteger, nullable=False, server_default=text(CURRENT_XID))
+    note_id = Column(Integer, nullable=False)
+    deleted_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_group_note_tombstones_group_id_sync_xid",
+            "group_id",
+            "sync_xid",
+            "sync_version",
+        ),
     )
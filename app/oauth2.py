@@ -4,6 +4,7 @@ from fastapi.params import Depends
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from functools import cached_property
+from typing import Optional
 from strawberry.fastapi import BaseContext
 from strawberry.types import Info as _Info
 from strawberry.types.info import RootValueType
@@ -74,14 +75,19 @@ def auth(request: Request):
     return get_current_user(token)
 
 
-def get_current_user(token: str, db: Session = database.SessionLocal()):
+def get_current_user(token: str, db: Optional[Session] = None):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Unauthorized credentials",
         headers={"WWW-AUTHENTICATE": "BEARER"},
     )
     token_data = verify_access_token(token, credentials_exception)
-    user = db.query(models.User).filter(token_data.user_id == models.User.id).first()
+    with database.session_scope(db) as db:
+        user = (
+            db.query(models.User)
+            .filter(token_data.user_id == models.User.id)
+            .first()
+        )
     return user
 
 
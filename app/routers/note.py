@@ -1,9 +1,12 @@
 from fastapi import APIRouter
 
 from app.types.note import Query, Mutation
-from strawberry import Schema
 from strawberry.fastapi import GraphQLRouter
 from app.oauth2 import get_context
+from app.execution import CompilingSchema
+from app.extensions import StatementTimeoutExtension
 
-schema = Schema(query=Query, mutation=Mutation)
+schema = CompilingSchema(
+    query=Query, mutation=Mutation, extensions=[StatementTimeoutExtension]
+)
 graphql_app = GraphQLRouter(schema=schema, context_getter=get_context)
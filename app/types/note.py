@@ -1,5 +1,6 @@
 from fastapi import Depends
 from strawberry import type, field, mutation, enum
+from strawberry.types.nodes import SelectedField
 from typing import List, Optional
 from datetime import datetime
 from enum import Enum
@@ -9,12 +10,18 @@ from app.types.types import (
     User,
     Note,
     PaginatedNotesResponse,
+    NoteCounts,
+    FeedPage,
+    ChangeSet,
     SharedResponse,
+    Group,
+    GroupSharedResponse,
     NoteWithParticipants,
     Permissions,
 )
 from app.helpers.note import (
     get_notes,
+    get_note_counts,
     create_note,
     update_note,
     get_note,
@@ -22,34 +29,145 @@ from app.helpers.note import (
     share_note,
     unshare_note,
     update_permission,
+    share_note_with_group,
+    unshare_note_with_group,
     list_shared_notes,
+    get_feed,
+    changes_since,
+    DetailProjection,
 )
+from app.helpers.user import search_users
+from app.helpers.group import create_group, add_group_member, remove_group_member
 from app.oauth2 import Info
 
 
+def _detail_projection(info: Info) -> DetailProjection:
+    """Pushes the detail and preview selections down to SQL."""
+    ranges = set()
+    with_preview = False
+    selections = list(info.selected_fields)
+    while selections:
+        selection = selections.pop()
+        selections.extend(selection.selections)
+        if not isinstance(selection, SelectedField):
+            continue
+        if selection.name == "detail":
+            # Literal arguments come through as their source text
+            offset = max(int(selection.arguments.get("offset") or 0), 0)
+            length = selection.arguments.get("length")
+            ranges.add((offset, None if length is None else max(int(length), 0)))
+        elif selection.name == "preview":
+            with_preview = True
+
+    # Differently ranged aliases of detail are all cut from the full text
+    offset, length = next(iter(ranges)) if len(ranges) == 1 else (0, None)
+    return DetailProjection(
+        offset=offset,
+        length=length,
+        selected=bool(ranges),
+        with_preview=with_preview,
+    )
+
+
 @type
 class Query:
     @field
     async def notes(
         self, info: Info, q: Optional[str] = "", page: Optional[int] = 1
     ) -> PaginatedNotesResponse:
-        notes = get_notes(current_user=info.context.user, q=q, page=page)
+        notes = await get_notes(
+            current_user=info.context.user,
+            q=q,
+            page=page,
+            projection=_detail_projection(info),
+        )
         return PaginatedNotesResponse(
-            notes=notes.get("notes"), total_pages=notes.get("total_pages")
+            notes=notes.get("notes"),
+            total_pages=notes.get("total_pages"),
+            total_notes=notes.get("total_notes"),
+            total_capped=notes.get("total_capped"),
+        )
+
+    @field
+    async def note_counts(self, info: Info) -> NoteCounts:
+        counts = get_note_counts(current_user=info.context.user)
+        return NoteCounts(
+            owned_notes=counts.get("owned_notes"),
+            shared_notes=counts.get("shared_notes"),
         )
 
     @field
     async def note(self, info: Info, id: int) -> NoteWithParticipants:
-        note = await get_note(current_user=info.context.user, id=id)
+        note = await get_note(
+            current_user=info.context.user,
+            id=id,
+            projection=_detail_projection(info),
+        )
         return NoteWithParticipants(
-            note=note.get("note"), participants=note.get("participants")
+            note=note.get("note"),
+            participants=note.get("participants"),
+            groups=note.get("groups"),
         )
 
     @field
     async def shared_notes(
         self, info: Info, limit: Optional[int] = 10, skip: Optional[int] = 0
     ) -> List[Note]:
-        return list_shared_notes(current_user=info.context.user, limit=limit, skip=skip)
+        return await list_shared_notes(
+            current_user=info.context.user,
+            limit=limit,
+            skip=skip,
+            projection=_detail_projection(info),
+        )
+
+    @field
+    async def feed(
+        self,
+        info: Info,
+        first: int = 10,
+        after: Optional[str] = None,
+        q: Optional[str] = "",
+    ) -> FeedPage:
+        feed = await get_feed(
+            current_user=info.context.user,
+            first=first,
+            after=after,
+            q=q,
+            projection=_detail_projection(info),
+        )
+        return FeedPage(
+            items=feed.get("items"),
+            end_cursor=feed.get("end_cursor"),
+            has_next_page=feed.get("has_next_page"),
+        )
+
+    @field
+    async def changes_since(
+        self,
+        info: Info,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> ChangeSet:
+        changes = await changes_since(
+            current_user=info.context.user,
+            cursor=cursor,
+            limit=limit,
+            projection=_detail_projection(info),
+        )
+        return ChangeSet(
+            changed=changes.get("changed"),
+            removed=changes.get("removed"),
+            cursor=changes.get("cursor"),
+            has_more=changes.get("has_more"),
+        )
+
+    @field
+    async def search_users(
+        self, info: Info, prefix: str, first: int = 10
+    ) -> List[User]:
+        return await search_users(
+            current_user=info.context.user, prefix=prefix, first=first
+        )
 
 
 @type
@@ -59,12 +177,20 @@ class Mutation:
         return create_note(current_user=info.context.user, title=title, detail=detail)
 
     @field
-    def update_note(self, info: Info, id: int, title: str, detail: str) -> Note:
+    def update_note(
+        self,
+        info: Info,
+        id: int,
+        title: str,
+        detail: str,
+        autosave: Optional[bool] = False,
+    ) -> Note:
         return update_note(
             current_user=info.context.user,
             id=id,
             title=title,
             detail=detail,
+            autosave=autosave,
         )
 
     @field
@@ -123,3 +249,66 @@ class Mutation:
             user=shared.get("user"),
             Permissions=shared.get("permission"),
         )
+
+    @field
+    async def create_group(self, info: Info, name: str) -> Group:
+        return await create_group(current_user=info.context.user, name=name)
+
+    @field
+    async def add_group_member(
+        self,
+        info: Info,
+        group_id: int,
+        user_id: int,
+    ) -> Group:
+        return await add_group_member(
+            current_user=info.context.user,
+            group_id=group_id,
+            user_id=user_id,
+        )
+
+    @field
+    async def remove_group_member(
+        self,
+        info: Info,
+        group_id: int,
+        user_id: int,
+    ) -> None:
+        return await remove_group_member(
+            current_user=info.context.user,
+            group_id=group_id,
+            user_id=user_id,
+        )
+
+    @field
+    async def share_note_with_group(
+        self,
+        info: Info,
+        id: int,
+        group_id: int,
+        permission: Optional[Permissions] = Permissions.read_only,
+    ) -> GroupSharedResponse:
+        shared = await share_note_with_group(
+            current_user=info.context.user,
+            id=id,
+            group_id=group_id,
+            permission=permission,
+        )
+        return GroupSharedResponse(
+            note=shared.get("note"),
+            group=shared.get("group"),
+            permission=shared.get("permission"),
+        )
+
+    @field
+    async def unshare_note_with_group(
+        self,
+        info: Info,
+        id: int,
+        group_id: int,
+    ) -> None:
+        return await unshare_note_with_group(
+            current_user=info.context.user,
+            id=id,
+            group_id=group_id,
+        )
@@ -0,0 +1,93 @@
+"""Plain containers the read path maps result rows into.
+
+They expose the same attributes as the strawberry types in
+app/types/types.py, which resolve them by attribute, without the cost of
+ORM instances or strawberry dataclasses.
+"""
+
+
+class UserRow:
+    __slots__ = ("id", "username", "email")
+
+    def __init__(self, id, username, email) -> None:
+        self.id = id
+        self.username = username
+        self.email = email
+
+
+class NoteRow:
+    __slots__ = (
+        "id",
+        "title",
+        "detail",
+        "created_at",
+        "updated_at",
+        "owner_id",
+        "owner",
+        "detail_offset",
+        "detail_length",
+        "preview",
+        "sync_version",
+    )
+
+    def __init__(
+        self,
+        id,
+        title,
+        detail,
+        created_at,
+        updated_at,
+        owner_id,
+        owner,
+        detail_offset=0,
+        detail_length=None,
+        preview=None,
+        sync_version=None,
+    ) -> None:
+        self.id = id
+        self.title = title
+        # Starts at character detail_offset of the note when only a range
+        # was loaded; preview is None unless selected
+        self.detail = detail
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.owner_id = owner_id
+        self.owner = owner
+        self.detail_offset = detail_offset
+        self.detail_length = detail_length
+        self.preview = preview
+        # The version the row was read at, autosaves only overwrite that one
+        self.sync_version = sync_version
+
+
+class ParticipantRow:
+    __slots__ = ("user", "permission")
+
+    def __init__(self, user, permission) -> None:
+        self.user = user
+        self.permission = permission
+
+
+class FeedItemRow:
+    __slots__ = ("note", "permission")
+
+    def __init__(self, note, permission) -> None:
+        self.note = note
+        self.permission = permission
+
+
+class GroupRow:
+    __slots__ = ("id", "name", "owner_id")
+
+    def __init__(self, id, name, owner_id) -> None:
+        self.id = id
+        self.name = name
+        self.owner_id = owner_id
+
+
+class GroupShareRow:
+    __slots__ = ("group", "permission")
+
+    def __init__(self, group, permission) -> None:
+        self.group = group
+        self.permission = permission
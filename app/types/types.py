@@ -1,5 +1,5 @@
 from strawberry import type, field, enum
-from typing import List
+from typing import List, Optional
 from enum import Enum
 from datetime import datetime
 
@@ -17,20 +17,59 @@ class Permissions(str, Enum):
     edit = "edit"
 
 
+# Characters of detail served by the preview field
+PREVIEW_LENGTH = 200
+
+
 @type
 class Note:
     id: int
     title: str
-    detail: str
     created_at: datetime
+    updated_at: datetime
     owner_id: int
     owner: User
 
+    # Resolved against rows that may only hold the requested range of the
+    # detail, see DetailProjection in app/helpers/note.py
+
+    @field
+    def detail(self, offset: Optional[int] = 0, length: Optional[int] = None) -> str:
+        start = max(offset or 0, 0) - self.detail_offset
+        if length is None:
+            return self.detail[start:]
+        return self.detail[start : start + max(length, 0)]
+
+    @field
+    def detail_length(self) -> int:
+        if self.detail_length is not None:
+            return self.detail_length
+        return len(self.detail)
+
+    @field
+    def preview(self) -> str:
+        if self.preview is not None:
+            return self.preview
+        return self.detail[:PREVIEW_LENGTH]
+
 
 @type
 class PaginatedNotesResponse:
     notes: List[Note]
     total_pages: int
+    total_notes: int
+    total_capped: bool
+
+
+@type
+class NoteCounts:
+    owned_notes: int
+    # Kept by triggers on shared_notes, a group share would have to update
+    # the counter of every member
+    shared_notes: int = field(
+        description="Notes shared with the user directly, notes shared with "
+        "one of their groups are not counted"
+    )
 
 
 @type
@@ -39,10 +78,24 @@ class Participant:
     permission: str
 
 
+@type
+class Group:
+    id: int
+    name: str
+    owner_id: int
+
+
+@type
+class GroupShare:
+    group: Group
+    permission: str
+
+
 @type
 class NoteWithParticipants:
     note: Note
     participants: List[Participant]
+    groups: List[GroupShare]
 
 
 @type
@@ -50,3 +103,31 @@ class SharedResponse:
     note: Note
     user: User
     Permissions: str
+
+
+@type
+class GroupSharedResponse:
+    note: Note
+    group: Group
+    permission: str
+
+
+@type
+class FeedItem:
+    note: Note
+    permission: str
+
+
+@type
+class FeedPage:
+    items: List[FeedItem]
+    end_cursor: Optional[str]
+    has_next_page: bool
+
+
+@type
+class ChangeSet:
+    changed: List[FeedItem]
+    removed: List[int]
+    cursor: str
+    has_more: bool
@@ -32,3 +32,65 @@ class TokenBucket:
             self.tokens -= 1
             return True
         return False
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on in-flight requests driven by observed latency.
+
+    The limit grows by about one per round trip while latency stays within
+    `tolerance` times the best recently seen, and is cut by `backoff` when
+    latency climbs past it or requests fail. Lower priorities may only use
+    a share of the limit so they are shed first.
+    """
+
+    # Fraction of the limit each priority may fill
+    SHARES = {"critical": 1.0, "normal": 0.9, "low": 0.7}
+
+    def __init__(
+        self,
+        initial_limit,
+        min_limit,
+        max_limit,
+        tolerance=2.0,
+        backoff=0.9,
+        probe_interval=1000,
+    ) -> None:
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.probe_interval = probe_interval
+        self.in_flight = 0
+        self.min_rtt = None
+        self.samples = 0
+        self.last_decrease = 0.0
+
+    def try_acquire(self, priority="normal"):
+        if self.in_flight >= self.limit * self.SHARES[priority]:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, rtt, dropped=False):
+        self.in_flight -= 1
+        self.samples += 1
+        # Forget the baseline now and then so it can follow real changes
+        if self.samples % self.probe_interval == 0:
+            self.min_rtt = None
+        if not dropped and (self.min_rtt is None or rtt < self.min_rtt):
+            self.min_rtt = rtt
+
+        now = time.monotonic()
+        if dropped or rtt > self.min_rtt * self.tolerance:
+            # Decrease at most once per round trip, one overload event
+            # should not collapse the limit
+            if now - self.last_decrease > rtt:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+        elif self.in_flight + 1 >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def retry_after(self):
+        """Seconds a shed client should wait, about one round trip."""
+        return max(1, round(self.min_rtt or 1))
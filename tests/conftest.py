@@ -0,0 +1,16 @@
+import os
+
+# app.config requires these; nothing in the tests connects to the database
+for name, value in {
+    "DATABASE_HOSTNAME": "localhost",
+    "DATABASE_PORT": "5432",
+    "DATABASE_PASSWORD": "test",
+    "DATABASE_NAME": "test",
+    "DATABASE_USERNAME": "test",
+    "SECRET_KEY": "test",
+    "REFRESH_SECRET_KEY": "test",
+    "ALGORITHM": "HS256",
+    "ACCESS_EXPIRE_MINUTES": "30",
+    "REFRESH_EXPIRE_MINUTES": "60",
+}.items():
+    os.environ.setdefault(name, value)
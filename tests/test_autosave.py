@@ -0,0 +1,130 @@
+import asyncio
+import threading
+
+from app.helpers.autosave import AutosaveBuffer
+from app.types.rows import NoteRow
+
+
+class FakeWrite:
+    """Records writes, blocking each one until `release` is set."""
+
+    def __init__(self, current_version: int = 1) -> None:
+        self.current_version = current_version
+        self.writes = []
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+
+    def __call__(self, user_id, note):
+        self.started.release()
+        self.release.wait(5)
+        self.writes.append((user_id, note.title, note.sync_version))
+        if note.sync_version != self.current_version:
+            return None
+        self.current_version += 1
+        return self.current_version
+
+    async def wait_started(self):
+        assert await asyncio.to_thread(self.started.acquire, timeout=5)
+
+
+def note(title, sync_version=1):
+    return NoteRow(1, title, "", None, None, 1, None, sync_version=sync_version)
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_flush_waits_for_the_previous_flush():
+    async def main():
+        write = FakeWrite()
+        buffer = AutosaveBuffer(60, write)
+        buffer.save(1, note("first"))
+        first = asyncio.ensure_future(buffer.flush(1))
+        await write.wait_started()
+
+        buffer.save(1, note("second"))
+        second = asyncio.ensure_future(buffer.flush(1))
+        await settle()
+        started_early = write.started.acquire(blocking=False)
+        write.release.set()
+        await asyncio.gather(first, second)
+        return started_early, write.writes
+
+    started_early, writes = asyncio.run(main())
+    assert not started_early
+    assert [title for _, title, _ in writes] == ["first", "second"]
+
+
+def test_newer_change_is_rebased_onto_the_written_version():
+    async def main():
+        write = FakeWrite()
+        buffer = AutosaveBuffer(60, write)
+        buffer.save(1, note("first"))
+        first = asyncio.ensure_future(buffer.flush(1))
+        await write.wait_started()
+
+        # Buffered while the first write runs, from the same version
+        buffer.save(1, note("second"))
+        write.release.set()
+        await first
+        await buffer.flush(1)
+        return write.writes, write.current_version
+
+    writes, version = asyncio.run(main())
+    assert writes == [(1, "first", 1), (1, "second", 2)]
+    assert version == 3
+
+
+def test_change_is_not_rebased_over_a_conflicting_write():
+    async def main():
+        write = FakeWrite(current_version=5)
+        buffer = AutosaveBuffer(60, write)
+        buffer.save(1, note("first"))
+        first = asyncio.ensure_future(buffer.flush(1))
+        await write.wait_started()
+
+        buffer.save(1, note("second"))
+        write.release.set()
+        await first
+        await buffer.flush(1)
+        return write.writes
+
+    assert asyncio.run(main()) == [(1, "first", 1), (1, "second", 1)]
+
+
+def test_discard_waits_for_a_running_flush():
+    async def main():
+        write = FakeWrite()
+        buffer = AutosaveBuffer(60, write)
+        buffer.save(1, note("first"))
+        flush = asyncio.ensure_future(buffer.flush(1))
+        await write.wait_started()
+
+        discard = asyncio.ensure_future(buffer.discard(1))
+        await settle()
+        waited = not discard.done()
+        write.release.set()
+        await discard
+        written = list(write.writes)
+        await flush
+        return waited, written, buffer.pending(1)
+
+    waited, written, pending = asyncio.run(main())
+    assert waited
+    assert written == [(1, "first", 1)]
+    assert pending is None
+
+
+def test_discard_drops_the_buffered_change():
+    async def main():
+        write = FakeWrite()
+        write.release.set()
+        buffer = AutosaveBuffer(60, write)
+        buffer.save(1, note("first"))
+        await buffer.discard(1)
+        await buffer.flush(1)
+        return write.writes
+
+    assert asyncio.run(main()) == []
@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from app.middleware.concurrency import classify
+
+
+def graphql_scope():
+    return {
+        "type": "http",
+        "path": "/graphql",
+        "method": "POST",
+        "headers": [(b"authorization", b"Bearer token")],
+    }
+
+
+@pytest.mark.parametrize(
+    "payload, priority",
+    [
+        ({"query": "mutation { deleteNote(id: 1) }"}, "critical"),
+        ({"query": "{ notes { id } }"}, "normal"),
+        ({"query": "{ notes(q: \"a\") { id } }"}, "low"),
+        ({"query": "query { notes { id } }", "variables": {"q": "a"}}, "low"),
+        ({"query": 5}, "normal"),
+        ({"query": "{a}", "variables": [1]}, "normal"),
+        ([1], "normal"),
+    ],
+)
+def test_classify(payload, priority):
+    assert classify(graphql_scope(), json.dumps(payload).encode()) == priority
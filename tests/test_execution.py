@@ -0,0 +1,154 @@
+import asyncio
+from typing import List, Optional
+
+import pytest
+import strawberry
+from strawberry.extensions import MaskErrors
+
+from app.config import settings
+from app.database import statement_timeout
+from app.execution import CompilingSchema
+from app.extensions import StatementTimeoutExtension
+
+
+class OwnerRow:
+    def __init__(self, id, username) -> None:
+        self.id = id
+        self.username = username
+
+
+class NoteRow:
+    def __init__(self, id, title, owner, tags) -> None:
+        self.id = id
+        self.title = title
+        self.owner = owner
+        self.tags = tags
+
+
+@strawberry.type
+class Owner:
+    id: int
+    username: str
+
+
+@strawberry.type
+class Note:
+    id: int
+    title: Optional[str]
+    owner: Owner
+    tags: List[str]
+
+    @strawberry.field
+    def shout(self) -> str:
+        return self.title.upper()
+
+
+NOTES = [
+    NoteRow(1, "first", OwnerRow(1, "ada"), ["a", "b"]),
+    NoteRow(2, None, OwnerRow(2, "bob"), []),
+    # Breaks non-null fields: Owner.username and the String! tag
+    NoteRow(3, "third", OwnerRow(3, None), ["c", None]),
+]
+
+
+@strawberry.type
+class Query:
+    @strawberry.field
+    async def notes(self, first: int = 10) -> List[Note]:
+        return NOTES[:first]
+
+    @strawberry.field
+    async def note(self, id: int) -> Optional[Note]:
+        return next((note for note in NOTES if note.id == id), None)
+
+    @strawberry.field
+    async def required_note(self, id: int) -> Note:
+        return next((note for note in NOTES if note.id == id), None)
+
+    @strawberry.field
+    async def failing(self) -> Optional[int]:
+        raise ValueError("failed")
+
+    @strawberry.field
+    async def timeout(self) -> Optional[int]:
+        return statement_timeout.get()
+
+
+QUERIES = [
+    ("{ notes { id title owner { id username } } }", None),
+    (
+        "{ mine: notes(first: 1) { key: id owner { name: username } } __typename }",
+        None,
+    ),
+    (
+        "query Note($id: Int!) { note(id: $id) { id title tags } }",
+        {"id": 1},
+    ),
+    ("query Note($id: Int!) { note(id: $id) { id } }", {"id": 404}),
+    # Non-null failures nulling the nearest nullable parent or the whole data
+    ("{ notes { id owner { username } } }", None),
+    ("{ note(id: 3) { id tags } }", None),
+    ("{ requiredNote(id: 404) { id } failing }", None),
+    ("{ note(id: 2) { shout } failing }", None),
+]
+INVALID_VARIABLES = ("query Note($id: Int!) { note(id: $id) { id } }", {"id": "x"})
+
+
+def run(schema, query, variables):
+    result = asyncio.run(schema.execute(query, variable_values=variables))
+    errors = [error.formatted for error in result.errors or ()]
+    return result.data, sorted(errors, key=lambda error: str(error.get("path")))
+
+
+def compile_schema(query, monkeypatch, **kwargs):
+    """A CompilingSchema with `query` compiled and its fallbacks recorded."""
+    schema = CompilingSchema(query=Query, **kwargs)
+    schema.register(query)
+    assert schema._plans[(query, None)] is not None
+
+    fallbacks = []
+    standard_execute = strawberry.Schema.execute
+
+    async def execute(self, *args, **kwargs):
+        if self is schema:
+            fallbacks.append(args)
+        return await standard_execute(self, *args, **kwargs)
+
+    monkeypatch.setattr(strawberry.Schema, "execute", execute)
+    return schema, fallbacks
+
+
+@pytest.mark.parametrize("query, variables", QUERIES)
+def test_compiled_matches_standard_executor(query, variables, monkeypatch):
+    standard = strawberry.Schema(query=Query)
+    compiling, fallbacks = compile_schema(query, monkeypatch)
+
+    assert run(compiling, query, variables) == run(standard, query, variables)
+    assert fallbacks == []
+
+
+def test_invalid_variables_fall_back(monkeypatch):
+    query, variables = INVALID_VARIABLES
+    standard = strawberry.Schema(query=Query)
+    compiling, fallbacks = compile_schema(query, monkeypatch)
+
+    assert run(compiling, query, variables) == run(standard, query, variables)
+    assert len(fallbacks) == 1
+
+
+def test_extension_hooks_run_around_compiled_operations(monkeypatch):
+    monkeypatch.setitem(settings.operation_timeouts, "Slow", 1234)
+    query = "query Slow { timeout }"
+    compiling, fallbacks = compile_schema(
+        query, monkeypatch, extensions=[StatementTimeoutExtension]
+    )
+
+    assert run(compiling, query, None) == ({"timeout": 1234}, [])
+    assert fallbacks == []
+
+
+def test_other_extensions_are_not_compiled():
+    schema = CompilingSchema(query=Query, extensions=[MaskErrors()])
+    schema.register("{ failing }")
+
+    assert schema._plans[("{ failing }", None)] is None
@@ -0,0 +1,107 @@
+import asyncio
+
+from app.config import settings
+from app.database import inflight_connections, statement_timeout
+from app.helpers.singleflight import SingleFlight
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SharedLoad:
+    """Stands in for a load, registering a connection like a statement does."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.connection = FakeConnection()
+        self.timeouts = []
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        inflight_connections.get().add(self.connection)
+        timeout = statement_timeout.get()
+        self.timeouts.append(timeout())
+        await self.release.wait()
+        self.timeouts.append(timeout())
+        return self.calls
+
+
+async def started():
+    # Lets the callers join and the shared call register its connection
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+async def request(flight, load, timeout=None, connections=None):
+    inflight_connections.set(connections)
+    statement_timeout.set(timeout)
+    return await flight.do("key", load)
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        flight, load = SingleFlight(), SharedLoad()
+        first = asyncio.ensure_future(request(flight, load))
+        second = asyncio.ensure_future(request(flight, load))
+        await asyncio.sleep(0)
+        load.release.set()
+        return await asyncio.gather(first, second), load.calls
+
+    assert asyncio.run(main()) == ([1, 1], 1)
+
+
+def test_call_uses_the_largest_timeout_of_its_waiters():
+    async def main():
+        flight, load = SingleFlight(), SharedLoad()
+        first = asyncio.ensure_future(request(flight, load, timeout=100))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(request(flight, load))
+        await asyncio.sleep(0)
+        load.release.set()
+        await asyncio.gather(first, second)
+        return load.timeouts
+
+    assert asyncio.run(main()) == [100, settings.statement_timeout_ms]
+
+
+def test_one_disconnect_does_not_cancel_the_others():
+    async def main():
+        flight, load = SingleFlight(), SharedLoad()
+        gone, staying = set(), set()
+        first = asyncio.ensure_future(request(flight, load, connections=gone))
+        second = asyncio.ensure_future(request(flight, load, connections=staying))
+        await started()
+        # What QueryCancellationMiddleware does when the first client leaves
+        for waiter in list(gone):
+            waiter.cancel()
+        cancelled = load.connection.cancelled
+        load.release.set()
+        await asyncio.gather(first, second)
+        return cancelled, gone, staying
+
+    assert asyncio.run(main()) == (False, set(), set())
+
+
+def test_last_waiter_leaving_cancels_the_queries():
+    async def main():
+        flight, load = SingleFlight(), SharedLoad()
+        gone = set()
+        waiting = asyncio.ensure_future(request(flight, load, connections=gone))
+        await started()
+        for waiter in list(gone):
+            waiter.cancel()
+        cancelled = load.connection.cancelled
+
+        # A caller arriving now does not join the abandoned call
+        load.release.set()
+        later = await request(flight, load)
+        await waiting
+        return cancelled, later, load.calls
+
+    assert asyncio.run(main()) == (True, 2, 2)
@@ -0,0 +1,86 @@
+import pytest
+
+from app.helpers.user import USER_SEARCH_MAX_RESULTS, PrefixCache, _prefix_end
+from app.types.rows import UserRow
+
+
+@pytest.mark.parametrize(
+    "prefix, end",
+    [
+        ("ab", "ac"),
+        ("a\U0010ffff", "b"),
+        # The code point after U+D7FF is U+E000, surrogates cannot be stored
+        ("a\ud7ff", "a\ue000"),
+        ("\U0010ffff\U0010ffff", None),
+        ("", None),
+    ],
+)
+def test_prefix_end(prefix, end):
+    assert _prefix_end(prefix) == end
+
+
+@pytest.mark.parametrize("prefix", ["ab", "a\ud7ff", "a\U0010ffff", "\ud7ff\uffff"])
+def test_prefix_end_bounds_every_match_in_byte_order(prefix):
+    end = _prefix_end(prefix).encode()
+    for suffix in ("", "a", "\ud7ff", "\ue000", "\U0010ffff"):
+        match = (prefix + suffix).encode()
+        assert prefix.encode() <= match < end
+
+
+def match(id, username, email=None):
+    email = email or f"{username}@example.com"
+    return (UserRow(id, username, email), (username.lower(), email.lower()))
+
+
+def test_cache_returns_the_exact_prefix():
+    cache = PrefixCache(maxsize=10, ttl=60)
+    users = [match(1, "ada"), match(2, "adb")]
+    cache.set("ad", users)
+
+    assert cache.get("ad") is users
+    assert cache.get("b") is None
+
+
+def test_short_result_answers_longer_prefixes():
+    cache = PrefixCache(maxsize=10, ttl=60)
+    cache.set("a", [match(1, "Ada"), match(2, "alan"), match(3, "bob", "ab@x.org")])
+
+    assert [user.id for user, _ in cache.get("ad")] == [1]
+    assert [user.id for user, _ in cache.get("ab")] == [3]
+    assert cache.get("ax") == []
+
+
+def test_full_result_does_not_answer_longer_prefixes():
+    cache = PrefixCache(maxsize=10, ttl=60)
+    users = [match(id, f"a{id:02}") for id in range(USER_SEARCH_MAX_RESULTS)]
+    cache.set("a", users)
+
+    assert cache.get("a") is users
+    assert cache.get("a0") is None
+
+
+def test_longest_cached_prefix_is_used():
+    cache = PrefixCache(maxsize=10, ttl=60)
+    cache.set("a", [match(1, "ada"), match(2, "adb")])
+    cache.set("ad", [match(1, "ada")])
+
+    assert [user.id for user, _ in cache.get("adb")] == []
+
+
+def test_expired_entries_are_dropped():
+    cache = PrefixCache(maxsize=10, ttl=-1)
+    cache.set("a", [match(1, "ada")])
+
+    assert cache.get("a") is None
+    assert cache.get("ad") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PrefixCache(maxsize=2, ttl=60)
+    cache.set("a", [])
+    cache.set("b", [])
+    cache.get("a")
+    cache.set("c", [])
+
+    assert cache.get("a") == []
+    assert cache.get("b") is None